@@ -0,0 +1,47 @@
+import sys, os, types, tempfile
+import pytest
+
+# sketchAuth holds the real tokens and isn't in the repo, so the tests get a stand-in with harmless values
+sketchAuth = types.ModuleType('sketchAuth')
+sketchAuth.__dict__.update({
+    'baseCallbackURL': 'https://sketch.test/',
+    'devPublicCallbackURL': 'https://dev.sketch.test/',
+    'internalPort': 8080,
+    'serverSecret': 'test server secret',
+    'serverURLSafeSecret': b'0' * 32,
+    'dbHost': 'localhost',
+    'dbPort': 3306,
+    'dbPassword': '',
+    'discordBotToken': '',
+    'discordClientID': 0,
+    'discordClientSecret': '',
+    'discordOwner': 0,
+    'discordTestServerID': 0,
+    'twitchBotID': '0',
+    'twitchClientID': '',
+    'twitchClientSecret': '',
+    'twitchOwnerID': '0',
+    'ytAccessToken': '',
+    'ytAppToken': '',
+    'ytClientID': '',
+    'ytClientSecret': '',
+    'ytRefreshToken': ''
+})
+sys.modules.setdefault('sketchAuth', sketchAuth)
+
+# sketchShared logs to ./logs and takes over stdout, stderr and the excepthook when it's imported, so import it somewhere out of the way and give pytest its streams back
+logDirectory = tempfile.mkdtemp(prefix='sketch-tests-')
+os.makedirs(os.path.join(logDirectory, 'logs'))
+originalDirectory = os.getcwd()
+originalStreams = (sys.stdout, sys.stderr, sys.excepthook)
+os.chdir(logDirectory)
+try:
+    import sketchShared
+finally:
+    os.chdir(originalDirectory)
+    sys.stdout, sys.stderr, sys.excepthook = originalStreams
+
+@pytest.fixture(scope='session', autouse=True)
+def stopSketchLogging():
+    yield
+    sketchShared.stopLogging()
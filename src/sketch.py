@@ -11,6 +11,8 @@ def exitHandler(*args):
 ----------------------------------------------------------------------------
 ----------------------------------------------------------------------------
 """)
+    # write out everything still waiting in the log queue
+    sketchShared.stopLogging()
 
 def main():
     warn("""
@@ -61,7 +63,7 @@ def main():
     loop.create_task(sketchDiscord.summon())
     loop.create_task(sketchTwitch.summon())
     loop.create_task(sketchServer.summon())
-    loop.create_task(sketchYoutube.youtubePrepareAllResubs())
+    loop.create_task(sketchYoutube.leaseScheduler.run())
     # makes the event loop run forever (this is blocking), so any current and future scheduled tasks will run until we explicitly tell the loop to die with loop.stop()
     loop.run_forever()
 
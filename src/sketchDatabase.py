@@ -2,8 +2,10 @@ import sketchShared
 from sketchShared import debug, info, warn, error, critical
 from tortoise.models import Model
 from tortoise import fields, Tortoise, run_async
+from tortoise.transactions import in_transaction
 import datetime, logging
 import sketchAuth
+from sketchModels import *
 
 # Initialize Tortoise ORM
 async def init():
@@ -15,6 +17,17 @@ async def init():
     )
     # Generate schemas for all models, safe=True means it will only recreate the tables when they arent there
     await Tortoise.generate_schemas(safe=True)
+    await migrateAnnouncedVideos()
+
+# moves the old YoutubeChannel.announcedVideos json lists into the YoutubeVideo table, then empties them so this only happens once per channel
+async def migrateAnnouncedVideos():
+    async for channel in YoutubeChannel.filter(announcedVideos__not_isnull=True):
+        async with in_transaction():
+            videos = [YoutubeVideo(youtubeChannel=channel, videoID=videoID) for videoID in dict.fromkeys(channel.announcedVideos)]
+            await YoutubeVideo.bulk_create(videos, batch_size=1000, ignore_conflicts=True)
+            channel.announcedVideos = None
+            await channel.save(update_fields=['announcedVideos'])
+        info(f'Migrated {len(videos)} announced videos for {channel.id} into YoutubeVideo.')
 
 # Close connections
 async def close():
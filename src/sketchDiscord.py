@@ -1,7 +1,8 @@
 import sketchShared
 from sketchShared import debug, info, warn, error, critical
-from typing import Any, Optional, Literal, List, Union
-import discord, asyncio, traceback, dateutil.parser, pytz, datetime, re, lxml.etree
+from typing import Any, Optional, Literal, List, Union, Callable, Awaitable
+import discord, asyncio, traceback, dateutil.parser, pytz, datetime, re, lxml.etree, collections, time, functools, math, tortoise.exceptions
+from tortoise.transactions import in_transaction
 from discord import app_commands
 from discord.ext import commands
 import sketchAuth
@@ -20,11 +21,12 @@ class SketchBot(commands.Bot):
         super().__init__(command_prefix=[], intents=intents, case_insensitive=True, status='a friend', allowed_mentions=discord.AllowedMentions.all())
 
     async def setup_hook(self) -> None:
-        # lists here are faster than a set because they will need to be fully iterated when removing a role, and are generally small (<25) so "if message in list" will be fast enough
-        # {'channelId': ['messageId','messageId','messageId','messageId']}
-        self.roleMessageDict: dict[int, list[discord.Message]] = {}
-        # get any needed data for servers from database here?
-        pass
+        # {messageID: RoleMessageRecord}
+        self.roleMessages: dict[int, RoleMessageRecord] = {}
+        # {channelID: {messageID: RoleMessageRecord}}, so listing the role messages in a channel doesn't go through every channel's messages
+        self.channelRoleMessages: dict[int, dict[int, RoleMessageRecord]] = {}
+        # load every role message up front, so the role message commands know about them without anyone pressing a button first
+        await loadRoleMessages()
 
     async def on_ready(self):
         info(f'Connected as {bot.user} (ID: {self.user.id}) to "' + '", "'.join(map(str, bot.guilds)) + '"')
@@ -39,9 +41,346 @@ failColour = discord.Colour.from_str('#2c3843')
 defaultColour = discord.Colour.from_str('#a92835')
 defaultColourHex = '#a92835'
 
+# sends announcements with a bounded number in flight at once, while only ever sending one at a time to each channel
+# discord rate limits message sends per channel, so queueing per channel means a guild with a slow bucket doesn't hold up everyone else
+class AnnouncementDispatcher:
+    def __init__(self, maxConcurrentSends: int = 10):
+        self.sendLimiter = asyncio.Semaphore(maxConcurrentSends)
+        # {channelID: asyncio.Lock}
+        self.channelLocks: dict[int, asyncio.Lock] = {}
+        # how many sends are waiting on or holding each channel lock, so the lock can be thrown away once nobody needs it
+        self.channelWaiting: dict[int, int] = {}
+        # seconds from a send being submitted to discord accepting it, only the most recent ones are kept
+        self.latencies: collections.deque[float] = collections.deque(maxlen=1000)
+
+    async def submit(self, channelID: int, send: Callable[[], Awaitable[Any]]) -> Any:
+        submitted = time.perf_counter()
+        lock = self.channelLocks.setdefault(channelID, asyncio.Lock())
+        self.channelWaiting[channelID] = self.channelWaiting.get(channelID, 0) + 1
+        try:
+            # wait for our turn in the channel before taking a slot, so sends queued behind a busy channel don't block other channels
+            async with lock:
+                async with self.sendLimiter:
+                    try:
+                        return await send()
+                    finally:
+                        latency = time.perf_counter() - submitted
+                        self.latencies.append(latency)
+                        debug(f'Announcement to channel {channelID} sent after {latency:.3f}s.')
+        finally:
+            self.channelWaiting[channelID] -= 1
+            if not self.channelWaiting[channelID]:
+                del self.channelWaiting[channelID]
+                del self.channelLocks[channelID]
+
+    # submits a list of (channelID, send) and waits for all of them, a failed send is logged instead of stopping the others
+    # returns the (channelID, send) jobs that failed, so the caller can try just those again
+    async def submitAll(self, jobs: list[tuple[int, Callable[[], Awaitable[Any]]]]) -> list[tuple[int, Callable[[], Awaitable[Any]]]]:
+        results = await asyncio.gather(*[self.submit(channelID, send) for channelID, send in jobs], return_exceptions=True)
+        failed = []
+        for job, result in zip(jobs, results):
+            if isinstance(result, BaseException):
+                error(f'Failed sending announcement to channel {job[0]}: {result!r}')
+                failed.append(job)
+        stats = self.stats()
+        if jobs and stats['sends']:
+            info(f'Sent {len(jobs) - len(failed)} of {len(jobs)} announcements. Over the last {stats["sends"]} sends, submit to sent took {stats["average"]:.3f}s on average, {stats["p95"]:.3f}s p95, {stats["max"]:.3f}s max.')
+        return failed
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {'sends': 0}
+        return {
+            'sends': len(latencies),
+            'average': sum(latencies) / len(latencies),
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'max': latencies[-1]
+        }
+
+announcementDispatcher = AnnouncementDispatcher(getattr(sketchAuth, 'discordMaxConcurrentAnnouncements', 10))
+
+# {guildID: frozenset of the owner and authorized user ids}, for checking dashboard permissions without the database
+# anything that changes a guild's owner or authorized users invalidates its entry
+authorizedUserCache = sketchShared.TTLCache(ttl=3600, maxSize=5000)
+
+# holds youtube upload notifications from the hub until a worker can announce them, so a burst of deliveries can't start an unbounded number of tasks
+# repeat deliveries of the same video that arrive close together are dropped, and notifications that fail are retried with a backoff
+class YoutubeNotificationQueue:
+    def __init__(self, maxSize: int = 1000, workers: int = 4, coalesceSeconds: float = 60, maxAttempts: int = 4):
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxSize)
+        self.workerCount = workers
+        self.workers: list[asyncio.Task] = []
+        self.coalesceSeconds = coalesceSeconds
+        self.maxAttempts = maxAttempts
+        # {(channelID, videoID, deleted): time it was queued}, oldest first so expired ones can be dropped from the front
+        self.recent: collections.OrderedDict[tuple[str, str, bool], float] = collections.OrderedDict()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        while len(self.workers) < self.workerCount:
+            self.workers.append(loop.create_task(self.work()))
+
+    # returns False if the queue is full, so the hub can be told to deliver it again later
+    def submit(self, video: dict) -> bool:
+        now = time.monotonic()
+        while self.recent and now - next(iter(self.recent.values())) > self.coalesceSeconds:
+            self.recent.popitem(last=False)
+
+        key = (video['channelID'], video['videoID'], video['deleted'])
+        if key in self.recent:
+            debug(f'Coalescing repeat notification for video {video["videoID"]}.')
+            return True
+        try:
+            self.queue.put_nowait(video)
+        except asyncio.QueueFull:
+            return False
+        self.recent[key] = now
+        return True
+
+    async def work(self):
+        await bot.wait_until_ready()
+        while True:
+            video = await self.queue.get()
+            try:
+                for attempt in range(1, self.maxAttempts + 1):
+                    try:
+                        await announceYoutubeUpload(video)
+                        break
+                    except Exception:
+                        if attempt == self.maxAttempts:
+                            error(f'Giving up announcing video {video["videoID"]} after {attempt} attempts: ' + traceback.format_exc())
+                        else:
+                            warn(f'Failed announcing video {video["videoID"]} (attempt {attempt}), retrying: ' + traceback.format_exc())
+                            await asyncio.sleep(2 ** attempt)
+            finally:
+                self.queue.task_done()
+
+youtubeNotificationQueue = YoutubeNotificationQueue(getattr(sketchAuth, 'youtubeNotificationQueueSize', 1000), getattr(sketchAuth, 'youtubeNotificationWorkers', 4))
+
+# adds and removes self-assigned roles for role button presses, so a crowd pressing buttons at once doesn't pile onto discord's role routes
+# presses wait per guild and are let through at a steady rate with a bounded number in flight, and a member pressing the same button again before
+# their first press ran just flips what's going to happen, so a double click turns into its net effect and only the last press gets a reply
+# the rate is a fixed guess rather than read from discord's rate limit headers, discord.py's http client keeps those to itself and already waits out any 429s
+class RoleMutationScheduler:
+    def __init__(self, maxInFlightPerGuild: int = 3, mutationsPerSecond: float = 5, burst: int = 10):
+        self.maxInFlightPerGuild = maxInFlightPerGuild
+        self.mutationsPerSecond = mutationsPerSecond
+        self.burst = burst
+        # {guildID: {(memberID, roleID): mutation}}, waiting to run in the order they were pressed
+        self.pending: dict[int, dict[tuple[int, int], dict]] = {}
+        # {(guildID, memberID, roleID): mutation}, being sent to discord right now
+        self.running: dict[tuple[int, int, int], dict] = {}
+        # {guildID: number of workers}
+        self.workers: dict[int, int] = {}
+        # {guildID: (tokens, time they were counted)}
+        self.buckets: dict[int, tuple[float, float]] = {}
+        # replies run on their own, since they use the interaction's webhook instead of the guild's role routes
+        self.replies: set[asyncio.Task] = set()
+        self.counts = {'pressed': 0, 'coalesced': 0, 'applied': 0, 'skipped': 0, 'failed': 0}
+
+    def submit(self, interaction: discord.Interaction, role: discord.Role, emoji: Optional[str] = None):
+        guildID = interaction.guild_id
+        key = (interaction.user.id, role.id)
+        self.counts['pressed'] += 1
+
+        guildPending = self.pending.setdefault(guildID, {})
+        mutation = guildPending.get(key)
+        if mutation:
+            # pressed again before it ran, so the earlier press gets cancelled out (or redone) and the newest press gets the reply
+            mutation['add'] = not mutation['add']
+            mutation['interaction'] = interaction
+            self.counts['coalesced'] += 1
+        else:
+            # if the same button is being applied right now, the member's roles from the interaction don't include that change yet
+            runningMutation = self.running.get((guildID,) + key)
+            hadRole = runningMutation['add'] if runningMutation else role in interaction.user.roles
+            guildPending[key] = {'member': interaction.user, 'role': role, 'emoji': emoji, 'hadRole': hadRole, 'add': not hadRole, 'interaction': interaction}
+
+        if self.workers.get(guildID, 0) < self.maxInFlightPerGuild:
+            self.workers[guildID] = self.workers.get(guildID, 0) + 1
+            asyncio.get_running_loop().create_task(self.work(guildID))
+
+    async def work(self, guildID: int):
+        guildPending = self.pending[guildID]
+        try:
+            while True:
+                # the oldest press that isn't for a button another worker is still applying for the same member
+                key = next((key for key in guildPending if (guildID,) + key not in self.running), None)
+                if key is None:
+                    break
+                mutation = guildPending.pop(key)
+                self.running[(guildID,) + key] = mutation
+                try:
+                    await self.apply(guildID, mutation)
+                finally:
+                    del self.running[(guildID,) + key]
+        finally:
+            self.workers[guildID] -= 1
+            if not self.workers[guildID]:
+                del self.workers[guildID]
+                if not guildPending:
+                    del self.pending[guildID]
+                    debug(f'Role changes for guild {guildID} done, totals: {self.stats()}')
+
+    # waits until the guild's bucket has a token, refilling it at mutationsPerSecond up to burst
+    async def takeToken(self, guildID: int):
+        while True:
+            now = time.monotonic()
+            tokens, counted = self.buckets.get(guildID, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted) * self.mutationsPerSecond)
+            if tokens >= 1:
+                self.buckets[guildID] = (tokens - 1, now)
+                return
+            self.buckets[guildID] = (tokens, now)
+            await asyncio.sleep((1 - tokens) / self.mutationsPerSecond)
+
+    async def apply(self, guildID: int, mutation: dict):
+        interaction: discord.Interaction = mutation['interaction']
+        member: discord.Member = mutation['member']
+        role: discord.Role = mutation['role']
+        # whether the role ended up added or removed, or None if nothing changed
+        added = mutation['add']
+        try:
+            # an even number of presses leaves the member how they started, so there's nothing to send
+            if mutation['add'] == mutation['hadRole']:
+                self.counts['skipped'] += 1
+                added = None
+            else:
+                await self.takeToken(guildID)
+                try:
+                    if mutation['add']:
+                        await member.add_roles(role, reason='Self-assigned role added!')
+                    else:
+                        await member.remove_roles(role, reason='Self-assigned role removed!')
+                except discord.Forbidden as err:
+                    raise discord.Forbidden(err.response, 'I must have "manage_roles" or "admin" permissions to grant/remove a role, and the role must be below my highest role on the servers list of roles!\n\n' + str(err))
+                self.counts['applied'] += 1
+        except Exception as err:
+            self.counts['failed'] += 1
+            await on_app_command_error(interaction, err)
+            return
+
+        reply = asyncio.get_running_loop().create_task(self.reply(interaction, role, mutation['emoji'], added))
+        self.replies.add(reply)
+        reply.add_done_callback(self.replies.discard)
+
+    async def reply(self, interaction: discord.Interaction, role: discord.Role, emoji: Optional[str], added: Optional[bool]):
+        try:
+            if added is None:
+                embed = BaseEmbed(title='No change!', description = '# ' + ('' if not emoji else emoji + ' ') + str(role) + "\nYour presses cancelled each other out, so you've still got the roles you had before.")
+            elif added:
+                embed = SuccessEmbed(title='Role acquired!', description = '# ' + ('' if not emoji else emoji + ' ') + str(role))
+            else:
+                embed = CancelEmbed(title='Role removed!', description = '# ' + ('' if not emoji else emoji + ' ') + str(role))
+            successMessage = await interaction.followup.send(embed=embed, ephemeral=True)
+            await successMessage.delete(delay=3)
+        except discord.HTTPException as err:
+            warn(f'Failed replying to role button press from {interaction.user} ({interaction.user.id}): {err!r}')
+
+    def stats(self) -> dict:
+        return dict(self.counts, waiting=sum(len(guildPending) for guildPending in self.pending.values()), running=len(self.running))
+
+roleMutationScheduler = RoleMutationScheduler(
+    getattr(sketchAuth, 'discordRoleMutationsInFlightPerGuild', 3),
+    getattr(sketchAuth, 'discordRoleMutationsPerSecond', 5),
+    getattr(sketchAuth, 'discordRoleMutationBurst', 10)
+)
+
+# {guildID: tuple of join role ids}, so member joins don't need the database
+# the join role endpoints on the web dashboard invalidate a guild's entry when they change it
+joinRoleCache = sketchShared.TTLCache(ttl=3600, maxSize=5000)
+
+async def getJoinRoleIDs(guildID: int) -> tuple[int, ...]:
+    roleIDs = joinRoleCache.get(guildID, joinRoleCache.missing)
+    if roleIDs is joinRoleCache.missing:
+        roleIDs = tuple(await DiscordJoinRole.filter(guild_id=guildID).values_list('id', flat=True))
+        joinRoleCache.set(guildID, roleIDs)
+    return roleIDs
+
+# gives new members their join roles, normally straight away
+# when a guild gets more than raidJoins joins inside raidWindowSeconds it switches to raid mode, where joins are queued and assigned at a steady pace until the queue empties
+class JoinRoleAssigner:
+    def __init__(self, raidJoins: int = 10, raidWindowSeconds: float = 10, raidAssignmentsPerSecond: float = 1):
+        self.raidJoins = raidJoins
+        self.raidWindowSeconds = raidWindowSeconds
+        self.raidAssignmentsPerSecond = raidAssignmentsPerSecond
+        # {guildID: deque of join times inside the window}
+        self.recentJoins: dict[int, collections.deque[float]] = {}
+        # {guildID: deque of member ids waiting for their join roles}, only for guilds in raid mode
+        self.raidQueues: dict[int, collections.deque[int]] = {}
+        self.raidWorkers: set[asyncio.Task] = set()
+
+    async def memberJoined(self, member: discord.Member):
+        guildID = member.guild.id
+        now = time.monotonic()
+        joins = self.recentJoins.setdefault(guildID, collections.deque())
+        joins.append(now)
+        while now - joins[0] > self.raidWindowSeconds:
+            joins.popleft()
+
+        if not await getJoinRoleIDs(guildID):
+            if len(joins) == 1 and guildID not in self.raidQueues:
+                # nothing to do for this guild, and nothing recent worth remembering
+                del self.recentJoins[guildID]
+            return
+
+        if guildID in self.raidQueues or len(joins) > self.raidJoins:
+            if guildID not in self.raidQueues:
+                warn(f'{len(joins)} members joined "{member.guild}" in {self.raidWindowSeconds}s, queueing their join roles.')
+                self.raidQueues[guildID] = collections.deque()
+                worker = asyncio.get_running_loop().create_task(self.drainRaid(member.guild))
+                self.raidWorkers.add(worker)
+                worker.add_done_callback(self.raidWorkers.discard)
+            self.raidQueues[guildID].append(member.id)
+            return
+
+        await self.assign(member)
+
+    # queued is for members that waited in a raid queue, whose roles may have been changed since they joined
+    async def assign(self, member: discord.Member, queued: bool = False):
+        roles = [role for role in map(member.guild.get_role, await getJoinRoleIDs(member.guild.id)) if role]
+        if not roles:
+            return
+        debug(f'New member {str(member)} ({str(member.id)}) joined server "{str(member.guild)}", giving them roles: ' + ', '.join(f'{role.name} ({role.id})' for role in roles))
+        if queued:
+            # one request per role, so self-roles or moderator edits made while they waited aren't overwritten by the cached role list
+            for _ in roles:
+                await roleMutationScheduler.takeToken(member.guild.id)
+            await member.add_roles(*roles, reason='Join role added!')
+        else:
+            await roleMutationScheduler.takeToken(member.guild.id)
+            # atomic=False sends every role in one request instead of one per role, by writing back the member's cached role list
+            # fine straight after the join, when nothing else has had a chance to change their roles
+            await member.add_roles(*roles, reason='Join role added!', atomic=len(roles) == 1)
+
+    async def drainRaid(self, guild: discord.Guild):
+        queue = self.raidQueues[guild.id]
+        try:
+            while queue:
+                member = guild.get_member(queue.popleft())
+                # skip anyone who already left
+                if member:
+                    try:
+                        await self.assign(member, queued=True)
+                    except Exception:
+                        # keep going, everyone else in the queue still needs their roles
+                        error(f'Failed giving join roles to {member} ({member.id}) in "{guild}": ' + traceback.format_exc())
+                await asyncio.sleep(1 / self.raidAssignmentsPerSecond)
+        finally:
+            del self.raidQueues[guild.id]
+            info(f'Finished queued join roles for "{guild}".')
+
+joinRoleAssigner = JoinRoleAssigner(
+    getattr(sketchAuth, 'discordJoinRaidJoins', 10),
+    getattr(sketchAuth, 'discordJoinRaidWindowSeconds', 10),
+    getattr(sketchAuth, 'discordJoinRaidAssignmentsPerSecond', 1)
+)
+
 # starts the bot when called
 async def summon():
     info("Summoning...")
+    youtubeNotificationQueue.start()
     await bot.start(sketchAuth.discordBotToken, reconnect=True)
 
 # MARK: FUNCTIONS ---------------------------------------------------------------------------------------------------------
@@ -56,16 +395,65 @@ async def test() -> str:
         return "Error: " + str(e)
     return "Success!"
 
+# hash of the guild names/owners and owner names the database was last brought up to date with, so reconnects where nothing changed skip the database
+lastGuildFingerprint: Optional[int] = None
+
 # sets database defaults for guilds that sketch is in and updates the owners and names of the guilds
+# reads the existing rows in one query per table and only writes the ones that are new or changed, since this runs again on every reconnect
 async def configNewGuilds():
+    global lastGuildFingerprint
     debug('In guilds: ' + str(bot.guilds))
-    for guild in bot.guilds:
-        # add guild to database, update name and owner id
-        await DiscordGuild.update_or_create(id=guild.id, defaults={'name': guild.name, 'owner': guild.owner_id})
-        # add owner to database, update name
-        await DiscordUser.update_or_create(id=guild.owner_id, defaults={'name': guild.owner.global_name, 'username': guild.owner.name})
+    # {guildID: (name, ownerID)}
+    gatewayGuilds = {guild.id: (guild.name, guild.owner_id) for guild in bot.guilds}
+    # {ownerID: (global name, username)}, owners that aren't cached are left alone until they are
+    gatewayOwners = {guild.owner_id: (guild.owner.global_name, guild.owner.name) for guild in bot.guilds if guild.owner}
+
+    fingerprint = hash((frozenset(gatewayGuilds.items()), frozenset(gatewayOwners.items())))
+    if fingerprint == lastGuildFingerprint:
+        debug('Guilds unchanged since last check, skipping database update.')
+        return
+
+    async with in_transaction():
+        # add guilds to database, update names and owner ids
+        dbGuilds = {dbGuild.id: dbGuild for dbGuild in await DiscordGuild.filter(id__in=list(gatewayGuilds))}
+        newGuilds, changedGuilds = [], []
+        for guildID, (name, ownerID) in gatewayGuilds.items():
+            dbGuild = dbGuilds.get(guildID)
+            if not dbGuild:
+                newGuilds.append(DiscordGuild(id=guildID, name=name, owner=ownerID))
+            elif dbGuild.name != name or dbGuild.owner != ownerID:
+                if dbGuild.owner != ownerID:
+                    authorizedUserCache.invalidate(guildID)
+                dbGuild.name = name
+                dbGuild.owner = ownerID
+                changedGuilds.append(dbGuild)
+        if newGuilds:
+            await DiscordGuild.bulk_create(newGuilds)
+        if changedGuilds:
+            await DiscordGuild.bulk_update(changedGuilds, fields=['name', 'owner'])
+
+        # add owners to database, update names
+        dbUsers = {dbUser.id: dbUser for dbUser in await DiscordUser.filter(id__in=list(gatewayOwners))}
+        newUsers, changedUsers = [], []
+        for userID, (name, username) in gatewayOwners.items():
+            dbUser = dbUsers.get(userID)
+            if not dbUser:
+                newUsers.append(DiscordUser(id=userID, name=name, username=username))
+            elif dbUser.name != name or dbUser.username != username:
+                dbUser.name = name
+                dbUser.username = username
+                changedUsers.append(dbUser)
+        if newUsers:
+            await DiscordUser.bulk_create(newUsers)
+        if changedUsers:
+            await DiscordUser.bulk_update(changedUsers, fields=['name', 'username'])
         # we dont add the guild the user owns to the list of authorized guilds, because it could change at any time and we don't have a way to separate manually authorized users from unauthorized ones
 
+    for guild in newGuilds:
+        authorizedUserCache.invalidate(guild.id)
+    lastGuildFingerprint = fingerprint
+    info(f'Guilds checked: {len(newGuilds)} added, {len(changedGuilds)} updated, {len(newUsers)} owners added, {len(changedUsers)} owners updated.')
+
 # tells discord what commands my bot knows
 async def syncAllCommandsToTestServer() -> None:
     warn('MANUALLY SYNCING ALL COMMANDS TO TEST SERVER')
@@ -86,15 +474,14 @@ async def syncAllCommands() -> None:
 def isOwner(interaction: discord.Interaction) -> bool:
     return interaction.user.id == sketchAuth.discordOwner
 
-# TODO removeAnnouncement
+# edits or deletes the announcement for a stream that went offline
+# the spamProtectionAnnounceDelay wait is handled by sketchTwitch's offline scheduler, so by the time this is called the delay (if any) is already over
+# dbStream's guild has to already be loaded
 async def removeAnnouncement(dbStream: TwitchAnnouncement):
-    await dbStream.fetch_related('guild')
     offlineURL = dbStream.offlineImageURL
     
     timeZone = dbStream.guild.timeZone
     deleteAnnouncements = dbStream.guild.deleteOldAnnouncements
-    # if this is not 0 (python treats a 0 value int as False) then theres a delay
-    spamProtectionAnnounceDelay = dbStream.guild.spamProtectionAnnounceDelay
 
     # get discord objects
     guild = bot.get_guild(dbStream.guild.id)
@@ -105,19 +492,6 @@ async def removeAnnouncement(dbStream: TwitchAnnouncement):
         # get announcement message
         announcement = await announceChannel.fetch_message(dbStream.messageID)
 
-        if spamProtectionAnnounceDelay:
-            utcTZ = pytz.timezone('UTC')
-            # if the stream hasn't had its end time stored yet ('ended' key does not exist)
-            if not dbStream.ended:
-                dbStream.ended = datetime.datetime.now(utcTZ)
-                await dbStream.save(update_fields=['ended'])
-                info(f'Delaying removal due to spamProtectionAnnounceDelay on {guild.name}.')
-                return
-            # else if the difference between now and the time the stream actually ended is less than the double ping delay time (badinternet) (spamProtectionAnnounceDelay)
-            elif (datetime.datetime.now(utcTZ) - dbStream.ended) < datetime.timedelta(minutes=spamProtectionAnnounceDelay):
-                return
-            # otherwise, continue and delete/edit the announcement
-
         if deleteAnnouncements:
             info(f'Removing announcement for {guild.name}.')
             await announcement.delete()
@@ -172,32 +546,17 @@ async def removeAnnouncement(dbStream: TwitchAnnouncement):
 
     except discord.errors.NotFound:
         error('Announcement no longer exists (deleted after announcing).')
-        if spamProtectionAnnounceDelay:
-            utcTZ = pytz.timezone('UTC')       
-            # if the stream hasn't had its end time stored yet ('ended' key does not exist)
-            if not dbStream.ended:
-                dbStream.ended = datetime.datetime.now(utcTZ)
-                await dbStream.save(update_fields=['ended'])
-                info(f'Delaying removal due to spamProtectionAnnounceDelay on {guild.name}.')
-                return
-            # else if the difference between now and the time the stream actually ended is less than the double ping delay time (badinternet) (spamProtectionAnnounceDelay)
-            elif (datetime.datetime.now(utcTZ) - dbStream.ended) < datetime.timedelta(minutes=spamProtectionAnnounceDelay):
-                return
-            # otherwise, continue and delete/edit the announcement
         info(f'Removing stored reference to deleted announcement for {dbStream.streamName}.')
 
     # reset the announcement holder
     dbStream.messageID = None
-    await dbStream.save(update_fields=['messageID'])
-    if dbStream.ended:
-        dbStream.ended = None
-        await dbStream.save(update_fields=['ended'])
+    dbStream.ended = None
+    await dbStream.save(update_fields=['messageID', 'ended'])
 
 async def makeAnnouncement(dbStream: TwitchAnnouncement, twitchioStream, game):
     # no more streamRole, just send the announce message
     # no more botChannel (unless i want a special override). old message: \nIf you don't want these notifications, go to " + botChannel.mention + " and type ``" + prefix + "notify``.
-    await dbStream.refresh_from_db()
-    await dbStream.fetch_related('guild')
+    # dbStream comes from the poll cycle's snapshot, so it's already fresh and its guild is already loaded
     timeZone = dbStream.guild.timeZone
     # no more prefix, only app commands
     # profileURL is in the dbStream at profileImageURL
@@ -235,51 +594,233 @@ async def makeAnnouncement(dbStream: TwitchAnnouncement, twitchioStream, game):
     else:
         embed.set_thumbnail(url='https://static-cdn.jtvnw.net/ttv-static/404_boxart.jpg')
     embed.add_field(name='Started',value=dateString, inline=True)
-    embed.add_field(name='Playing',value=game.name, inline=True)
+    embed.add_field(name='Playing',value=game.name if game else 'No Game or Unknown', inline=True)
 
     sent = await announceChannel.send(message, embed=embed)
     debug(f'Sent message to {str(announceChannel.guild)}: {sent}')
     dbStream.messageID = sent.id
     await dbStream.save(update_fields=['messageID'])
 
-async def announceYoutubeUpload(xmlBytes):
+# the hub only ever sends small atom feeds with one or two entries, anything much bigger than this isn't from youtube
+youtubeMaxNotificationBytes = 64 * 1024
+# doesn't fetch or expand anything the document points at
+youtubeNotificationParser = lxml.etree.XMLParser(resolve_entities=False, no_network=True, remove_blank_text=True)
+youtubeNamespaces = {'atom': 'http://www.w3.org/2005/Atom', 'yt': 'http://www.youtube.com/xml/schemas/2015', 'at': 'http://purl.org/atompub/tombstones/1.0'}
+# compiled once here instead of building the namespace map and paths again for every notification
+youtubeEntries = lxml.etree.XPath('/atom:feed/atom:entry', namespaces=youtubeNamespaces)
+youtubeEntryFields = {
+    'videoID': lxml.etree.XPath('string(yt:videoId)', namespaces=youtubeNamespaces),
+    'channelID': lxml.etree.XPath('string(yt:channelId)', namespaces=youtubeNamespaces),
+    'title': lxml.etree.XPath('string(atom:title)', namespaces=youtubeNamespaces),
+    'url': lxml.etree.XPath('string(atom:link[@rel="alternate"]/@href)', namespaces=youtubeNamespaces),
+    'channelName': lxml.etree.XPath('string(atom:author/atom:name)', namespaces=youtubeNamespaces),
+    'published': lxml.etree.XPath('string(atom:published)', namespaces=youtubeNamespaces),
+    'updated': lxml.etree.XPath('string(atom:updated)', namespaces=youtubeNamespaces)
+}
+# <at:deleted-entry ref="yt:video:VIDEO_ID" when="..."> is sent instead of an entry when a video is deleted or made private
+youtubeDeletedEntries = lxml.etree.XPath('/atom:feed/at:deleted-entry', namespaces=youtubeNamespaces)
+youtubeDeletedEntryFields = {
+    'videoID': lxml.etree.XPath('substring-after(@ref, "yt:video:")', namespaces=youtubeNamespaces),
+    'channelID': lxml.etree.XPath('substring-after(at:by/atom:uri, "/channel/")', namespaces=youtubeNamespaces),
+    'url': lxml.etree.XPath('string(atom:link/@href)', namespaces=youtubeNamespaces),
+    'channelName': lxml.etree.XPath('string(at:by/atom:name)', namespaces=youtubeNamespaces),
+    'updated': lxml.etree.XPath('string(@when)', namespaces=youtubeNamespaces)
+}
+
+# pulls every video out of a notification from the hub, deleted videos come back with deleted set and anything that can't be read gives an empty list
+def parseYoutubeNotification(xmlBytes: bytes) -> list[dict]:
     # https://developers.google.com/youtube/v3/guides/push_notifications
-    tree = lxml.etree.fromstring(xmlBytes)
-    if tree.find('entry', tree.nsmap) is None:
-        print('Ignoring deleted YouTube video.')
-        return
-    # store a copy of the youtube video number so i dont re-announce youtube videos if they just get updated, have to parse the xml of the text out for relevant bits
-    videoID = tree.find('entry/yt:videoId', tree.nsmap).text
-    channelID = tree.find('entry/yt:channelId', tree.nsmap).text
-    videoTitle = tree.find('entry/title', tree.nsmap).text
-    videoURL = tree.find('entry/link', tree.nsmap).get('href')
-    channelName = tree.find('entry/author/name', tree.nsmap).text
-    
-    # get the YoutubeChannel from db associated with this channel
-    dbChannel = await YoutubeChannel.get_or_none(id=channelID)
-    
-    if not dbChannel:
-        info(f'There is no channel in the database associated with {channelID}, so video {videoURL} will be ignored.')
-        return
+    if len(xmlBytes) > youtubeMaxNotificationBytes:
+        warn(f'Ignoring YouTube notification of {len(xmlBytes)} bytes, larger than {youtubeMaxNotificationBytes}.')
+        return []
+    try:
+        tree = lxml.etree.fromstring(xmlBytes, youtubeNotificationParser)
+    except lxml.etree.XMLSyntaxError:
+        warn('Could not read YouTube notification: ' + traceback.format_exc())
+        return []
+    # the hub never sends a DTD, and xpath's string() expands any entities one declares even though the parser leaves them alone
+    if tree.getroottree().docinfo.internalDTD is not None:
+        warn('Ignoring YouTube notification that declares a DTD.')
+        return []
+
+    videos = []
+    for entry in youtubeEntries(tree):
+        # store a copy of the youtube video number so i dont re-announce youtube videos if they just get updated, have to parse the xml of the text out for relevant bits
+        video = {field: str(path(entry)) or None for field, path in youtubeEntryFields.items()}
+        video['deleted'] = False
+        videos.append(video)
+    for entry in youtubeDeletedEntries(tree):
+        video = {field: str(path(entry)) or None for field, path in youtubeDeletedEntryFields.items()}
+        video.update({'title': None, 'published': None, 'deleted': True})
+        videos.append(video)
+
+    readable = []
+    for video in videos:
+        if not video['videoID'] or not video['channelID']:
+            warn(f'Ignoring YouTube notification entry without a video or channel id: {video}')
+            continue
+        for field in ('published', 'updated'):
+            try:
+                video[field] = datetime.datetime.fromisoformat(video[field]) if video[field] else None
+            except ValueError:
+                video[field] = None
+        readable.append(video)
+    if not readable:
+        info('Ignoring YouTube notification with no videos.')
+    return readable
+
+# what's already been decided about recently notified videos, {videoID: (kind, updated)}, so repeat notifications are answered without the database
+youtubeVideoStates = sketchShared.TTLCache(ttl=86400, maxSize=10000)
+# videos that were published longer ago than this are old videos being pushed again (made public again, description edited etc.), not new uploads
+youtubeNewUploadAge = datetime.timedelta(hours=getattr(sketchAuth, 'youtubeNewUploadHours', 24))
+
+# works out what a notification is for: 'new' upload, metadata 'update' of a known video, 'old' video being pushed again, 'deleted' video, a 'repeat' of one already handled, or an 'unknown' channel
+# only 'new' gets announced, every video that gets this far is stored so it's never announced later
+async def classifyYoutubeNotification(video: dict) -> str:
+    videoID = video['videoID']
+    if video['deleted']:
+        # kept in the database (if it was there) so it isn't announced if it comes back
+        youtubeVideoStates.set(videoID, ('deleted', video['updated']))
+        return 'deleted'
+
+    cached = youtubeVideoStates.get(videoID)
+    if cached:
+        kind, updated = cached
+        if kind == 'deleted' or not video['updated'] or (updated and video['updated'] <= updated):
+            return 'repeat'
+        await YoutubeVideo.filter(youtubeChannel_id=video['channelID'], videoID=videoID).update(title=video['title'], updated=video['updated'])
+        youtubeVideoStates.set(videoID, (kind, video['updated']))
+        return 'update'
+
+    if not await YoutubeChannel.exists(id=video['channelID']):
+        return 'unknown'
+
+    published = video['published']
+    old = published and published < datetime.datetime.now(datetime.timezone.utc) - youtubeNewUploadAge
+    # the (channel, video) unique index means only the first notification for a video gets to insert it, so inserting is how we claim it for announcing
+    try:
+        await YoutubeVideo.create(youtubeChannel_id=video['channelID'], videoID=videoID, title=video['title'], published=published, updated=video['updated'])
+        kind = 'old' if old else 'new'
+    except tortoise.exceptions.IntegrityError:
+        await YoutubeVideo.filter(youtubeChannel_id=video['channelID'], videoID=videoID).update(title=video['title'], updated=video['updated'])
+        kind = 'update'
+    youtubeVideoStates.set(videoID, (kind, video['updated']))
+    return kind
+
+# raises if any announcement couldn't be sent, and remembers its progress on the video dict so the notification queue's retry
+# carries on from there: the video stays claimed by this notification instead of looking like a repeat, and only the failed sends go again
+async def announceYoutubeUpload(video: dict):
+    videoTitle = video['title']
+    videoURL = video['url']
+
+    if 'failedSends' in video:
+        jobs = video['failedSends']
     else:
-        if videoID in dbChannel.announcedVideos:
-            info(f'Video {videoURL} has already been announced. Ignoring.')
+        if 'kind' not in video:
+            video['kind'] = await classifyYoutubeNotification(video)
+        if video['kind'] != 'new':
+            info(f'Not announcing video {videoURL} from {video["channelID"]}: {video["kind"]}.')
             return
-        elif dbChannel.announcedVideos:
-            dbChannel.announcedVideos.append(videoID)
-        else:
-            dbChannel.announcedVideos = [videoID]
-        await dbChannel.save(update_fields=['announcedVideos'])
-        
-    # loop through all the connected announcements, announcing them
-    async for announcement in dbChannel.youtubeAnnouncements:
-        await announcement.fetch_related('guild')
+        jobs = await getYoutubeAnnouncementJobs(video['channelID'], videoTitle, videoURL)
+
+    failed = await announcementDispatcher.submitAll(jobs)
+    if failed:
+        video['failedSends'] = failed
+        raise RuntimeError(f'{len(failed)} of {len(jobs)} announcements of {videoURL} failed to send.')
+
+# hand all the connected announcements to the dispatcher so every guild gets announced at once instead of one after another
+async def getYoutubeAnnouncementJobs(channelID: str, videoTitle: str, videoURL: str) -> list[tuple[int, Callable[[], Awaitable[Any]]]]:
+    jobs = []
+    for announcement in await YoutubeAnnouncement.filter(youtubeChannel_id=channelID).select_related('guild'):
         guild = bot.get_guild(announcement.guild.id)
-        announceChannel = guild.get_channel(announcement.channelID)
+        announceChannel = guild.get_channel(announcement.channelID) if guild else None
+        if not announceChannel:
+            warn(f'Could not find channel {announcement.channelID} to announce {videoURL} in, skipping.')
+            continue
         message = announcement.announcementText + f'\n**[{videoTitle}]({videoURL})**'
-        
-        sent = await announceChannel.send(message)
-        debug(f'Sent message to {str(announceChannel.guild)}: {sent}')
+        jobs.append((announcement.channelID, functools.partial(sendYoutubeAnnouncement, announceChannel, message)))
+    return jobs
+
+async def sendYoutubeAnnouncement(announceChannel: discord.abc.Messageable, message: str):
+    sent = await announceChannel.send(message)
+    debug(f'Sent message to {str(announceChannel.guild)}: {sent}')
+
+# what's kept in memory for a role message, instead of holding on to the whole discord.Message
+class RoleMessageRecord:
+    def __init__(self, messageID: int, channelID: int, title: str, description: str, buttons: dict[str, dict]):
+        self.messageID = messageID
+        self.channelID = channelID
+        self.title = title
+        self.description = description
+        # {customID: {'roleID': int, 'emoji': str, 'label': str}}, in the order the buttons are on the message
+        self.buttons = buttons
+
+    def __repr__(self) -> str:
+        return f'RoleMessageRecord(messageID={self.messageID}, channelID={self.channelID}, buttons={len(self.buttons)})'
+
+def cacheRoleMessage(record: RoleMessageRecord):
+    bot.roleMessages[record.messageID] = record
+    bot.channelRoleMessages.setdefault(record.channelID, {})[record.messageID] = record
+
+def uncacheRoleMessage(messageID: int) -> Optional[RoleMessageRecord]:
+    record = bot.roleMessages.pop(messageID, None)
+    if record:
+        channelMessages = bot.channelRoleMessages.get(record.channelID)
+        if channelMessages is not None:
+            channelMessages.pop(messageID, None)
+            if not channelMessages:
+                del bot.channelRoleMessages[record.channelID]
+    return record
+
+# loads all the role messages and their buttons from the database in two queries
+async def loadRoleMessages():
+    roleMessages = await RoleMessage.all().prefetch_related('buttons')
+    for roleMessage in roleMessages:
+        buttons = {}
+        for button in sorted(roleMessage.buttons, key=lambda button: button.position):
+            buttons[button.customID] = {'roleID': button.roleID, 'emoji': button.emoji, 'label': button.label}
+        cacheRoleMessage(RoleMessageRecord(roleMessage.id, roleMessage.channelID, roleMessage.title or '', roleMessage.description or '', buttons))
+    info(f'Loaded {len(roleMessages)} role messages.')
+
+# reads the role buttons straight off the message's components
+def roleMessageRecordFromMessage(message: discord.Message) -> RoleMessageRecord:
+    buttons = {}
+    for row in message.components:
+        for component in getattr(row, 'children', [row]):
+            customID = getattr(component, 'custom_id', None)
+            if customID and customID.startswith('r:'):
+                # split 0 = r, split 1 = numDuplicate, split 2 = roleId
+                buttons[customID] = {
+                    'roleID': int(customID.split(':')[2]),
+                    'emoji': str(component.emoji) if component.emoji else None,
+                    'label': component.label
+                }
+    embed = message.embeds[0] if message.embeds else None
+    title = (embed.title or '') if embed else ''
+    description = (embed.description or '') if embed else ''
+    return RoleMessageRecord(message.id, message.channel.id, title, description, buttons)
+
+# saves a role message as it is now (usually right after editing it), replacing whatever buttons were saved for it before
+async def saveRoleMessage(message: discord.Message) -> RoleMessageRecord:
+    record = roleMessageRecordFromMessage(message)
+    async with in_transaction():
+        await RoleMessage.update_or_create(id=record.messageID, defaults={
+            'channelID': record.channelID,
+            'guild_id': message.guild.id if message.guild else None,
+            'title': record.title,
+            'description': record.description
+        })
+        await RoleButton.filter(roleMessage_id=record.messageID).delete()
+        await RoleButton.bulk_create([
+            RoleButton(roleMessage_id=record.messageID, customID=customID, roleID=button['roleID'], emoji=button['emoji'], label=button['label'], position=position)
+            for position, (customID, button) in enumerate(record.buttons.items())
+        ])
+    cacheRoleMessage(record)
+    return record
+
+async def forgetRoleMessage(messageID: int):
+    uncacheRoleMessage(messageID)
+    await RoleMessage.filter(id=messageID).delete()
 
 # takes a space delimited list of discord guild ids and turns them into generic discord objects
 class GuildListTransformer(app_commands.Transformer):
@@ -708,14 +1249,8 @@ class ConfirmRoleBtn(discord.ui.Button):
         # im sorry
         newEmbed.description = newEmbed.description + newLines + ((str(goodEmoji) + ': ') if goodEmoji else ((newLabel + ': ') if newLabel != newDescription else newLabel)) + (newDescription if newLabel != newDescription else ('' if not goodEmoji else newDescription))
         
-        # if this process was started by a "new role message" command then add the message to the cache 
-        if self.view.deleteOnCancel:
-            if interaction.channel_id in bot.roleMessageDict:
-                bot.roleMessageDict[interaction.channel_id].append(roleMessage)
-            else:
-                bot.roleMessageDict[interaction.channel_id] = [roleMessage]
-
-        await roleMessage.edit(embed=newEmbed, view=newView)
+        editedMessage = await roleMessage.edit(embed=newEmbed, view=newView)
+        await saveRoleMessage(editedMessage)
 
         await interaction.delete_original_response()
 
@@ -729,25 +1264,19 @@ class SelectRoleMessageView(BaseView):
     def __init__(self, *args, channel: Optional[Union[discord.abc.GuildChannel, discord.abc.PrivateChannel, discord.Thread]] = None, timeout=180, deletingButton = False, **kwargs):
         super().__init__(*args, timeout=timeout, **kwargs)
 
-        # get list of messages in channel
-        self.messagePages = []
-        chunkSize = 25
-        allChannelRoleMessages = bot.roleMessageDict.get(channel.id)
-        # convert all messages into a PartialMessage
-        while allChannelRoleMessages:
-            chunk, allChannelRoleMessages = allChannelRoleMessages[:chunkSize], allChannelRoleMessages[chunkSize:]
-            self.messagePages.append(chunk)
-        debug('Created chunked list of messages: ' + str(self.messagePages))
+        self.deletingButton = deletingButton
+        # pages are sliced out of the channel's role messages when they're shown, rather than chunking the whole list up front
+        self.chunkSize = 25
+        self.roleMessages = list(bot.channelRoleMessages.get(channel.id, {}).values())
+        self.pageCount = math.ceil(len(self.roleMessages) / self.chunkSize)
+        debug(f'Listing {len(self.roleMessages)} role messages over {self.pageCount} pages')
 
         self.currentPage = 0
-        if self.messagePages:
-            self.currentMessageSelect = ChunkedMessageSelect(self.messagePages[0], deletingButton)
-        else:
-            self.currentMessageSelect = ChunkedMessageSelect(self.messagePages, deletingButton)
+        self.currentMessageSelect = ChunkedMessageSelect(self.getPage(0), deletingButton)
         self.add_item(self.currentMessageSelect)
 
         # if theres 0 or 1 pages in the list, disable forward navigation
-        if len(self.messagePages) <= 1:
+        if self.pageCount <= 1:
             self.nextPage.disabled=True
 
     @discord.ui.button(label='⬅ Previous', style=discord.ButtonStyle.blurple, row=1, disabled=True)
@@ -758,7 +1287,7 @@ class SelectRoleMessageView(BaseView):
 
         self.remove_item(self.currentMessageSelect)
         # the button starts disabled and disables itself any time page goes to 0 so this can never be called at 0
-        self.currentMessageSelect = ChunkedMessageSelect(self.messagePages[self.currentPage])
+        self.currentMessageSelect = ChunkedMessageSelect(self.getPage(self.currentPage), self.deletingButton)
         self.add_item(self.currentMessageSelect)
 
         if self.currentPage <= 0:
@@ -766,7 +1295,7 @@ class SelectRoleMessageView(BaseView):
         else:
             self.previousPage.disabled=False
 
-        if (self.currentPage + 1) >= len(self.messagePages):
+        if (self.currentPage + 1) >= self.pageCount:
             self.nextPage.disabled=True
         else:
             self.nextPage.disabled=False
@@ -793,7 +1322,7 @@ class SelectRoleMessageView(BaseView):
 
         self.remove_item(self.currentMessageSelect)
         # starts disabled if not enough pages left and disables when not enough pages left so can never exceed index
-        self.currentMessageSelect = ChunkedMessageSelect(self.messagePages[self.currentPage])
+        self.currentMessageSelect = ChunkedMessageSelect(self.getPage(self.currentPage), self.deletingButton)
         self.add_item(self.currentMessageSelect)
 
         if self.currentPage <= 0:
@@ -801,7 +1330,7 @@ class SelectRoleMessageView(BaseView):
         else:
             self.previousPage.disabled=False
 
-        if (self.currentPage + 1) >= len(self.messagePages):
+        if (self.currentPage + 1) >= self.pageCount:
             self.nextPage.disabled=True
         else:
             self.nextPage.disabled=False
@@ -818,27 +1347,29 @@ class SelectRoleMessageView(BaseView):
                 embed.set_field_at(
                     -1,
                     name=embed.fields[-1].name,
-                    value='Page ' + str(self.currentPage+1) + '/' + str(len(self.messagePages))
+                    value='Page ' + str(self.currentPage+1) + '/' + str(self.pageCount)
                 )
             else:
                 embed.add_field(
                     name='Current Page',
-                    value='Page ' + str(self.currentPage+1) + '/' + str(len(self.messagePages))
+                    value='Page ' + str(self.currentPage+1) + '/' + str(self.pageCount)
                 )
         return embed
 
+    def getPage(self, page: int) -> list[RoleMessageRecord]:
+        return self.roleMessages[page * self.chunkSize:(page + 1) * self.chunkSize]
+
     async def on_timeout(self):
         debug('select message view timed out')
         await super().on_timeout()
 
 class ChunkedMessageSelect(discord.ui.Select):
-    def __init__(self, options: List[discord.Message]=[], deletingButton=False):
-        self.originalMessages = options
+    def __init__(self, options: List[RoleMessageRecord]=[], deletingButton=False):
         self.deletingButton = deletingButton
 
         if options:
-            # use list comprehension to turn the passed list of roles into a list of SelectOptions
-            self.optionsMessage = [discord.SelectOption(label=message.embeds[0].title[:100], value=str(message.id), description=message.embeds[0].description[:100]) for message in options]
+            # use list comprehension to turn the passed list of role messages into a list of SelectOptions
+            self.optionsMessage = [discord.SelectOption(label=record.title[:100] or 'Role message', value=str(record.messageID), description=record.description[:100] or None) for record in options]
             super().__init__(placeholder='Select a role message...', min_values=1, max_values=1, options=self.optionsMessage)
         else:
             super().__init__(placeholder='No role messages in this channel!', min_values=1, max_values=1, disabled=True, options=[discord.SelectOption(label='')])
@@ -851,11 +1382,14 @@ class ChunkedMessageSelect(discord.ui.Select):
         await interaction.response.defer()
 
         selectedMessage = None
-        for message in self.originalMessages:
-            if message.id == int(self.values[0]):
-                selectedMessage = await message.fetch()
+        selectedID = int(self.values[0])
+        if selectedID in bot.roleMessages:
+            try:
+                selectedMessage = await interaction.channel.fetch_message(selectedID)
                 self.view.roleMessage = selectedMessage
-                break
+            except discord.NotFound:
+                # deleted while we weren't watching, so stop offering it
+                await forgetRoleMessage(selectedID)
         
         if not selectedMessage:
             raise Exception('idk some stuff wonky that role message got messed up')
@@ -942,7 +1476,8 @@ class RoleButtonSelect(discord.ui.Select):
                 buttonToDelete = discord.utils.get(self.roleMessageView.children, custom_id=self.values[0])
                 self.roleMessageView.remove_item(buttonToDelete)
                 
-                await self.roleMessage.edit(embed=newEmbed, view=self.roleMessageView)
+                editedMessage = await self.roleMessage.edit(embed=newEmbed, view=self.roleMessageView)
+                await saveRoleMessage(editedMessage)
 
                 await interaction.delete_original_response()
                 embed = SuccessEmbed(title='Role button removed!')
@@ -969,6 +1504,7 @@ async def on_guild_join(guild: discord.Guild):
                 dbUser.username = inviter.name
                 await dbUser.save()
                 await dbUser.authorizedGuilds.add(await DiscordGuild.get(id=guild.id))
+                authorizedUserCache.invalidate(guild.id)
                 break
 
 @bot.event
@@ -976,6 +1512,7 @@ async def on_guild_update(before: discord.Guild, after: discord.Guild):
     if before.owner_id != after.owner_id:
         info(f"Guild updated owner: {after.name}.")
         await DiscordGuild.update_or_create(id=after.id, defaults={'name': after.name, 'owner': after.owner_id})
+        authorizedUserCache.invalidate(after.id)
         await DiscordUser.update_or_create(id=after.owner_id, defaults={'name': after.owner.global_name, 'username': after.owner.name})
 
 @bot.event
@@ -986,18 +1523,28 @@ async def on_guild_remove(guild: discord.Guild):
     # async for announcement in dbGuild.twitchAnnouncements:
     #     await announcement.delete()
     if dbGuild:
-        dbGuild.delete()
+        await dbGuild.delete()
+    authorizedUserCache.invalidate(guild.id)
+    joinRoleCache.invalidate(guild.id)
+
+# forget role messages that get deleted, so they stop showing up in the role message commands
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    if payload.message_id in bot.roleMessages:
+        info(f'Role message {payload.message_id} was deleted, forgetting it.')
+        await forgetRoleMessage(payload.message_id)
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    for messageID in payload.message_ids:
+        if messageID in bot.roleMessages:
+            info(f'Role message {messageID} was deleted, forgetting it.')
+            await forgetRoleMessage(messageID)
 
 # on member join give stream role
 @bot.event
 async def on_member_join(member: discord.Member):
-    dbGuild = await DiscordGuild.get_or_none(id=member.guild.id)
-    if dbGuild:
-        async for role in dbGuild.joinRoles:
-            role = member.guild.get_role(role.id)
-            if role:
-                debug(f'New member {str(member)} ({str(member.id)}) joined server "{str(member.guild)}", giving them role {str(role.name)} ({str(role.id)}).')
-                await member.add_roles(role)
+    await joinRoleAssigner.memberJoined(member)
 
 # error handling for app command errors
 @bot.tree.error
@@ -1019,7 +1566,7 @@ async def on_app_command_error(interaction: discord.Interaction, err):
     except discord.errors.InteractionResponded:
         await interaction.followup.send(embed=embed, ephemeral=True)
 
-# logs when interactions are made, and responds to buttons without needing to re-create views or store roles in DB :3
+# logs when interactions are made, and responds to role buttons without needing to re-create views :3
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
     info((('Command "' + str(interaction.command.name)) if interaction.command else ('Component "' + str(interaction.data))) + '" invoked by ' + str(interaction.user.name) + ' ('+ str(interaction.user.id) +') on server "' + str(interaction.guild) + '".')
@@ -1034,56 +1581,25 @@ async def on_interaction(interaction: discord.Interaction):
             customId: str = interaction.data["custom_id"]
             if customId.startswith('r:'):
                 await interaction.response.defer()
-                
-                # split 0 = r, split 1 = numDuplicate, split 2 = roleId
-                customId = customId.split(':')[2]
-                debug('ROLE BUTTON PRESSED, ROLE ID: ' + customId)
-                newRoleId = int(customId)
-                
-                # check if we need to cache this guy
-                if interaction.channel_id in bot.roleMessageDict:
-                    if interaction.message not in bot.roleMessageDict[interaction.channel_id]:
-                        warn('Role button pressed from a message that isnt in channel cache, caching message.')
-                        bot.roleMessageDict[interaction.channel_id].append(interaction.message)
-                else:
-                    warn('Role button pressed from a message that isnt in cache at all, caching channel and message.')
-                    bot.roleMessageDict[interaction.channel_id] = [interaction.message]
 
                 try:
-                    newRole = interaction.guild.get_role(newRoleId)
+                    # everything about the button comes from the role message registry, so a press costs no REST calls besides the role change itself
+                    record = bot.roleMessages.get(interaction.message.id)
+                    roleButton = record.buttons.get(customId) if record else None
+                    # role messages made before they were saved to the database get saved the first time one of their buttons is used
+                    if not roleButton:
+                        warn('Role button pressed from a role message that isnt saved, saving message.')
+                        record = await saveRoleMessage(interaction.message)
+                        roleButton = record.buttons.get(customId)
+                    if not roleButton:
+                        raise ValueError("I couldn't find that button on the role message! (Button ID: " + customId + ")")
+                    debug('ROLE BUTTON PRESSED, ROLE ID: ' + str(roleButton['roleID']))
+
+                    # the guild's roles are all cached by the gateway, so a miss means the role was deleted
+                    newRole = interaction.guild.get_role(roleButton['roleID'])
                     if not newRole:
-                        guildRoles = await interaction.guild.fetch_roles()
-                        for role in guildRoles:
-                            if role.id == newRoleId:
-                                newRole = role
-                                break
-                    if newRole:
-                        try:
-                            if newRole not in interaction.user.roles:
-                                await interaction.user.add_roles(newRole, reason='Self-assigned role added!')
-                                roleRemoved = False
-                            else:
-                                await interaction.user.remove_roles(newRole, reason='Self-assigned role removed!')
-                                roleRemoved = True
-                        except discord.Forbidden as err:
-                            raise discord.Forbidden(err.response, 'I must have "manage_roles" or "admin" permissions to grant/remove a role, and the role must be below my highest role on the servers list of roles!\n\n' + str(err))
-                    else:
-                        raise ValueError("I couldn't find that role on the server! (Role ID: " + customId + ")")
-                    
-                    roleView = discord.ui.View.from_message(interaction.message)
-                    buttonEmoji = None
-                    for child in roleView.children:
-                        if child.custom_id == interaction.data["custom_id"]:
-                            buttonEmoji = child.emoji
-                    
-                    if roleRemoved:
-                        embed = CancelEmbed(title='Role removed!', description = '# ' + ('' if not buttonEmoji else str(buttonEmoji) + ' ') + str(newRole))
-                        successMessage = await interaction.followup.send(embed=embed, ephemeral=True)
-                        await successMessage.delete(delay=3)
-                    else:
-                        embed = SuccessEmbed(title='Role acquired!', description = '# ' + ('' if not buttonEmoji else str(buttonEmoji) + ' ') + str(newRole))
-                        successMessage = await interaction.followup.send(embed=embed, ephemeral=True)
-                        await successMessage.delete(delay=3)
+                        raise ValueError("I couldn't find that role on the server! (Role ID: " + str(roleButton['roleID']) + ")")
+                    roleMutationScheduler.submit(interaction, newRole, roleButton['emoji'])
 
                 except Exception as err:
                     await on_app_command_error(interaction, err)
@@ -1231,7 +1747,7 @@ async def addrolebutton(interaction: discord.Interaction) -> None:
     view = SelectRoleMessageView(channel=interaction.channel)
     embed = await view.getEmbed(BaseEmbed(
         title="Choose the role message to add a button to!",
-        description="""To add a button, please select the self-assignable role message from this channel that you want to add the button to.\n\nDiscord only lets me have 25 options in a list... so use the buttons to navigate pages if you have more messages than that!\n\n*Note: If it says there are no role messages, just use a button on an existing role message in this channel and then try this command again.*""",
+        description="""To add a button, please select the self-assignable role message from this channel that you want to add the button to.\n\nDiscord only lets me have 25 options in a list... so use the buttons to navigate pages if you have more messages than that!""",
         thumbnail = interaction.guild.icon
     ))
     view.message = await interaction.followup.send(embed=embed, view=view, ephemeral=True)
@@ -1245,7 +1761,7 @@ async def deleterolebutton(interaction: discord.Interaction) -> None:
     view = SelectRoleMessageView(channel=interaction.channel, deletingButton=True)
     embed = await view.getEmbed(BaseEmbed(
         title="Choose the role message to remove a button from!",
-        description="""To remove a button, please select the self-assignable role message from this channel that you want to remove the button from.\n\nDiscord only lets me have 25 options in a list... so use the buttons to navigate pages if you have more messages than that!\n\n*Note: If it says there are no role messages, just use a button on an existing role message in this channel and then try this command again.*""",
+        description="""To remove a button, please select the self-assignable role message from this channel that you want to remove the button from.\n\nDiscord only lets me have 25 options in a list... so use the buttons to navigate pages if you have more messages than that!""",
         thumbnail = interaction.guild.icon
     ))
     view.message = await interaction.followup.send(embed=embed, view=view, ephemeral=True)
\ No newline at end of file
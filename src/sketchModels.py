@@ -34,6 +34,7 @@ class DiscordGuild(models.Model):
     twitchAnnouncements: fields.ReverseRelation["TwitchAnnouncement"]
     youtubeAnnouncements: fields.ReverseRelation["YoutubeAnnouncement"]
     joinRoles: fields.ReverseRelation["DiscordJoinRole"]
+    roleMessages: fields.ReverseRelation["RoleMessage"]
 
 class DiscordUser(models.Model):
     id = UnsignedBigIntField(primary_key=True, generated=False)
@@ -52,6 +53,30 @@ class DiscordJoinRole(models.Model):
     id = UnsignedBigIntField(primary_key=True, generated=False)
     name = fields.TextField(null=True)
     guild: fields.ForeignKeyRelation["DiscordGuild"] = fields.ForeignKeyField('models.DiscordGuild', related_name = 'joinRoles', on_delete = fields.OnDelete.CASCADE)
+
+# self-assignable role messages, stored so they can be loaded when the bot starts instead of waiting for someone to press one of their buttons
+class RoleMessage(models.Model):
+    # the discord message id
+    id = UnsignedBigIntField(primary_key=True, generated=False)
+    channelID = UnsignedBigIntField()
+    title = fields.TextField(null=True)
+    description = fields.TextField(null=True)
+    
+    guild: fields.ForeignKeyRelation["DiscordGuild"] = fields.ForeignKeyField('models.DiscordGuild', related_name = 'roleMessages', on_delete = fields.OnDelete.CASCADE, null=True)
+    buttons: fields.ReverseRelation["RoleButton"]
+
+class RoleButton(models.Model):
+    id = fields.IntField(primary_key=True)
+    # 'r:' + number of other buttons for the same role + ':' + role id
+    customID = fields.CharField(max_length=100)
+    roleID = UnsignedBigIntField()
+    # str() of the emoji, discord.PartialEmoji.from_str turns it back into an emoji
+    emoji = fields.TextField(null=True)
+    label = fields.TextField(null=True)
+    # where the button is on the message, left to right
+    position = fields.IntField(default=0)
+    
+    roleMessage: fields.ForeignKeyRelation["RoleMessage"] = fields.ForeignKeyField('models.RoleMessage', related_name = 'buttons', on_delete = fields.OnDelete.CASCADE)
         
 class TwitchAnnouncement(models.Model):
     id = fields.IntField(primary_key=True)
@@ -69,14 +94,40 @@ class TwitchAnnouncement(models.Model):
 class YoutubeChannel(models.Model):
     id = fields.CharField(primary_key=True, max_length=100, null=False)
     
-    # https://tortoise.github.io/query.html?h=jsonfield
-    # https://tortoise.github.io/fields.html?h=jsonfield#tortoise.fields.data.JSONField
-    # filter __contains
+    # old list of announced video ids, replaced by YoutubeVideo. only read when migrating it into YoutubeVideo on startup (sketchDatabase), and emptied after
     announcedVideos = fields.JSONField[list](null=True)
     leaseSeconds = fields.IntField(null=True)
     time = fields.DatetimeField(null=True)
     
     youtubeAnnouncements: fields.ReverseRelation["YoutubeAnnouncement"]
+    videos: fields.ReverseRelation["YoutubeVideo"]
+    backfill: fields.BackwardOneToOneRelation["YoutubeBackfill"]
+
+# every video we know about on a channel (already uploaded when the channel was added, or announced since)
+# unique on (youtubeChannel, videoID) so "has this been announced" is an index lookup, and inserting is how a video gets claimed for announcing
+class YoutubeVideo(models.Model):
+    id = fields.IntField(primary_key=True)
+    # youtube video ids are 11 characters, leave some room
+    videoID = fields.CharField(max_length=20)
+    title = fields.TextField(null=True)
+    published = fields.DatetimeField(null=True)
+    updated = fields.DatetimeField(null=True)
+    
+    youtubeChannel: fields.ForeignKeyRelation["YoutubeChannel"] = fields.ForeignKeyField('models.YoutubeChannel', related_name = 'videos', on_delete = fields.OnDelete.CASCADE)
+
+    class Meta:
+        unique_together = (('youtubeChannel', 'videoID'),)
+
+# progress collecting the videos a channel already had when it was added, so the backfill can carry on from the last page after a restart
+class YoutubeBackfill(models.Model):
+    id = fields.IntField(primary_key=True)
+    # the next playlistItems page to request, None before the first page and after the last one
+    pageToken = fields.TextField(null=True)
+    videosGathered = fields.IntField(default=0)
+    complete = fields.BooleanField(default=False)
+    error = fields.TextField(null=True)
+    
+    youtubeChannel: fields.OneToOneRelation["YoutubeChannel"] = fields.OneToOneField('models.YoutubeChannel', related_name = 'backfill', on_delete = fields.OnDelete.CASCADE)
 
 class YoutubeAnnouncement(models.Model):
     id = fields.IntField(primary_key=True)
@@ -1,9 +1,10 @@
 import sketchShared
 from sketchShared import debug, info, warn, error, critical
-import asyncio, aiohttp, aiohttp.web, logging, aiohttp_jinja2, jinja2, aiohttp_session, aiohttp_session.cookie_storage, aiohttp_csrf, secrets, uuid, datetime, pytz, base64, json
+import asyncio, aiohttp, aiohttp.web, logging, aiohttp_jinja2, jinja2, aiohttp_session, aiohttp_session.cookie_storage, aiohttp_csrf, secrets, uuid, datetime, pytz, base64, json, time, random, functools, collections, os
 from secrets import compare_digest
 from urllib.parse import urlencode
 from typing import Optional
+from tortoise.expressions import Q
 import sketchAuth, sketchYoutube, sketchDiscord, sketchTwitch
 from sketchModels import *
 
@@ -64,6 +65,76 @@ class SketchFormAndHeaderPolicy(SketchHeaderPolicy, SketchFormPolicy):
 
         return False
 
+# MARK: REQUEST LOGGING
+
+# every request gets a short debug line with its timing, only a sample also log their headers and body (and only bodies up to the size cap)
+requestLogSampleRate = getattr(sketchAuth, 'requestLogSampleRate', 0.05)
+requestLogMaxBodyBytes = getattr(sketchAuth, 'requestLogMaxBodyBytes', 2048)
+# {route: deque of (queue, handler, template) seconds}, only the most recent requests for each route are kept
+routeTimings: dict[str, collections.deque[tuple[float, float, float]]] = {}
+
+# outermost middleware, so it sees the request before the session and csrf middlewares
+# queue time is from here until the handler starts (session loading, csrf checks), handler time is the handler itself up to rendering, template time is rendering
+@aiohttp.web.middleware
+async def requestLoggingMiddleware(request: aiohttp.web.Request, handler):
+    request['timingStart'] = time.perf_counter()
+    if random.random() < requestLogSampleRate and logging.getLogger().isEnabledFor(logging.DEBUG):
+        await logRequestSample(request)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except aiohttp.web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        end = time.perf_counter()
+        handlerStart = request.get('handlerStart', end)
+        templateStart = request.get('templateStart', end)
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else 'unmatched'
+        timing = (handlerStart - request['timingStart'], templateStart - handlerStart, end - templateStart)
+        routeTimings.setdefault(route, collections.deque(maxlen=1000)).append(timing)
+        debug('%s %s from %s: %s in %.1fms (queue %.1fms, handler %.1fms, template %.1fms)', request.method, request.path, request.remote, status, (end - request['timingStart']) * 1000, timing[0] * 1000, timing[1] * 1000, timing[2] * 1000)
+
+# innermost middleware, marks when the handler actually starts
+@aiohttp.web.middleware
+async def handlerTimingMiddleware(request: aiohttp.web.Request, handler):
+    request['handlerStart'] = time.perf_counter()
+    return await handler(request)
+
+async def logRequestSample(request: aiohttp.web.Request):
+    if not request.body_exists:
+        body = ''
+    elif request.content_length is not None and request.content_length <= requestLogMaxBodyBytes:
+        # read() keeps the body, so the handler can still read it after this
+        body = (await request.read()).decode(errors='replace')
+    else:
+        body = f'<{request.content_length or "unknown"} bytes not logged>'
+    debug('Sampled request %s from %s headers %s body %s', request, request.remote, dict(request.headers), body)
+
+# {route: {'requests', 'queue', 'handler', 'template'}} with the average seconds for each part
+def routeTimingStats() -> dict:
+    stats = {}
+    for route, timings in routeTimings.items():
+        stats[route] = {'requests': len(timings)}
+        for part, values in zip(('queue', 'handler', 'template'), zip(*timings)):
+            stats[route][part] = sum(values) / len(values)
+    return stats
+
+# same as aiohttp_jinja2.template, but marks when rendering starts so the logging middleware can time it separately from the handler
+def timedTemplate(templateName: str):
+    def wrapper(handler):
+        @functools.wraps(handler)
+        async def wrapped(request: aiohttp.web.Request):
+            context = await handler(request)
+            if isinstance(context, aiohttp.web.StreamResponse):
+                return context
+            request['templateStart'] = time.perf_counter()
+            return await aiohttp_jinja2.render_template_async(templateName, request, context)
+        return wrapped
+    return wrapper
+
 async def summon():
     info('Summoning...')
     if sketchShared.dev:
@@ -98,6 +169,12 @@ async def on_startup(app):
     # TODO disable/remove this for "production"
     logging.getLogger("aiohttp.access").setLevel(logging.WARN)
 
+    # the server has to be up for twitch to verify eventsub webhook subscriptions, so sync them now
+    sketchTwitch.requestEventSubSync()
+
+    # youtube backfills need the client session, which only exists once the server is starting
+    await sketchYoutube.resumeYoutubeBackfills()
+
     # await test('')
 
 async def on_shutdown(app):
@@ -115,11 +192,19 @@ csrf_storage = aiohttp_csrf.storage.SessionStorage('csrf_token', secret_phrase=s
 aiohttp_csrf.setup(app, policy=csrf_policy, storage=csrf_storage)
 aiohttp_session.setup(app, aiohttp_session.cookie_storage.EncryptedCookieStorage(sketchAuth.serverURLSafeSecret, max_age=604800, httponly=True, secure=True, samesite='Lax'))
 app.middlewares.append(aiohttp_csrf.csrf_middleware)
+app.middlewares.insert(0, requestLoggingMiddleware)
+app.middlewares.append(handlerTimingMiddleware)
 
 app.on_startup.append(on_startup)
 app.on_shutdown.append(on_shutdown)
 global clientSession
 
+# discord sessions that have already been checked against the database, {userID: (sessionID, state, expiryTime, rotateStateAt, DiscordUser)}
+# a user only has one session in the database at a time, so keying by user means logging in again replaces the old one
+authSessionCache = sketchShared.TTLCache(ttl=300, maxSize=1000)
+# how often a logged in session gets a new state, instead of on every request
+authStateRotationSeconds = getattr(sketchAuth, 'authStateRotationSeconds', 300)
+
 
 # MARK: FUNCTIONS ---------------------------------------------------------------------------------------------------------
 
@@ -219,6 +304,7 @@ async def getDiscordCodeTokens(code, state, session: aiohttp_session.Session) ->
             dbUser.expiryTime = expiryDateTime
             dbUser.state = state
             dbUser.sessionID = session['sessionID']
+            authSessionCache.invalidate(dbUser.id)
             dbUser.profileImageURL = f'https://cdn.discordapp.com/avatars/{user['id']}/{user['avatar']}.png'
             
             # Partial saves are now supported (#157): obj.save(update_fields=['model','field','names'])
@@ -334,9 +420,18 @@ async def validateDiscordAuth(session: aiohttp_session.Session, request: aiohttp
             debug(f"Date from cookie: {cookieExpiry}")
             debug(f"Date from now: {oneMinAgo}")
             error("Session expired.")
+            authSessionCache.invalidate(session['userID'])
             await newSession(request)
             return None
 
+        # already validated recently, so only the cookie needs checking against what the database had
+        cached = authSessionCache.get(session['userID'])
+        if cached and cached[:3] == (session['sessionID'], session['state'], session['expiryTime']):
+            _, _, _, rotateStateAt, dbUser = cached
+            if time.monotonic() >= rotateStateAt:
+                await rotateDiscordAuthState(session, dbUser)
+            return dbUser
+
         # get the user from database
         dbUser = await DiscordUser.get_or_none(id=session['userID'])
         if not dbUser:
@@ -349,22 +444,47 @@ async def validateDiscordAuth(session: aiohttp_session.Session, request: aiohttp
             error(f"state, expiryTime, or sessionID mismatch with database user: {await dbUser.all().values()}")
             if dbUser.expiryTime:
                 debug(f"Cookie: {session['expiryTime']} Database: {dbUser.expiryTime.isoformat()}")
+            authSessionCache.invalidate(dbUser.id)
             await newSession(request)
             return None
         
-        # generate a new state
-        session['state'] = secrets.token_urlsafe(32)
-        dbUser.state = session['state']
-        await dbUser.save(update_fields=['state'])
-        session.changed()
-        
-        debug(f"Created new state for authorized user: {session['state']}")
+        await rotateDiscordAuthState(session, dbUser)
         
         return dbUser
 
     error("No user variables in session.")
     return None
 
+# generates a new state for a validated session and remembers the session, so it doesn't need the database again until the next rotation
+async def rotateDiscordAuthState(session: aiohttp_session.Session, dbUser: DiscordUser):
+    session['state'] = secrets.token_urlsafe(32)
+    dbUser.state = session['state']
+    await dbUser.save(update_fields=['state'])
+    session.changed()
+    authSessionCache.set(dbUser.id, (session['sessionID'], session['state'], session['expiryTime'], time.monotonic() + authStateRotationSeconds, dbUser))
+    
+    debug(f"Created new state for authorized user: {session['state']}")
+
+# gets every guild the user owns or is authorized in, with everything the dashboard shows for them
+# this is the same 5 queries however many guilds there are (the guilds, then one each for the related lists), and only the fields the template uses are kept
+async def loadDashboardGuilds(user: DiscordUser) -> list[dict]:
+    dbGuilds = await DiscordGuild.filter(Q(owner=user.id) | Q(authorizedUsers__id=user.id)).distinct().prefetch_related('twitchAnnouncements', 'authorizedUsers', 'joinRoles', 'youtubeAnnouncements')
+    guilds = []
+    for guild in dbGuilds:
+        guilds.append({
+            'id': guild.id,
+            'name': guild.name,
+            'timeZone': guild.timeZone,
+            'deleteOldAnnouncements': guild.deleteOldAnnouncements,
+            'spamProtectionAnnounceDelay': guild.spamProtectionAnnounceDelay,
+            'joinRoles': [{'id': role.id, 'name': role.name} for role in guild.joinRoles],
+            'authorizedUsers': [{'id': authorizedUser.id, 'name': authorizedUser.name, 'username': authorizedUser.username} for authorizedUser in guild.authorizedUsers],
+            'twitchAnnouncements': [{'id': announcement.id, 'streamName': announcement.streamName, 'channelID': announcement.channelID, 'announcementText': announcement.announcementText} for announcement in guild.twitchAnnouncements],
+            # the channel id is already on the announcement, so the youtube channels themselves don't need loading
+            'youtubeAnnouncements': [{'id': announcement.id, 'youtubeChannelID': announcement.youtubeChannel_id, 'channelID': announcement.channelID, 'announcementText': announcement.announcementText} for announcement in guild.youtubeAnnouncements]
+        })
+    return guilds
+
 # TODO create validateYoutubeAuth that is the same as discordAuth validation, but just removes the variables from the session cookie instead of making a new session
 
 async def checkAuthorized(user: DiscordUser, guildID) -> bool:
@@ -374,18 +494,104 @@ async def checkAuthorized(user: DiscordUser, guildID) -> bool:
     
     debug(f"Checking authorization for discord user: {user.name} and guild: {guildID}")
     
-    dbGuild = await DiscordGuild.get(id=guildID)
-    authorized = False
-    if user.id == dbGuild.owner:
-        authorized = True
-    else:
-        await dbGuild.fetch_related("authorizedUsers")
-        for authorizedUser in dbGuild.authorizedUsers:
-            if user.id == authorizedUser.id:
-                authorized = True
-                break
-
-    return authorized
+    guildID = int(guildID)
+    authorizedUsers = sketchDiscord.authorizedUserCache.get(guildID)
+    if authorizedUsers is None:
+        # the owner and every authorized user in one query, joined through discordauthorizedguild_user on its (guild, user) index
+        rows = await DiscordGuild.filter(id=guildID).values_list('owner', 'authorizedUsers__id')
+        if not rows:
+            error(f"Checking authorization for discord user: {user.name} but guild {guildID} isn't in the database")
+            return False
+        authorizedUsers = frozenset([rows[0][0]] + [authorizedUserID for _, authorizedUserID in rows if authorizedUserID])
+        sketchDiscord.authorizedUserCache.set(guildID, authorizedUsers)
+
+    return user.id in authorizedUsers
+
+# MARK: LOG VIEWER
+
+logPageDefaultLines = 200
+logPageMaxLines = 2000
+# {token: userID}, handed out by the log page for opening the live tail
+logStreamTokens = sketchShared.TTLCache(ttl=3600, maxSize=100)
+
+# sketch.log and then its rotated backups sketch.log.1 (newest) to sketch.log.25 (oldest)
+def getLogFilePath(fileIndex: int) -> str:
+    path = sketchShared.rootHandler.baseFilename
+    return path if fileIndex == 0 else f'{path}.{fileIndex}'
+
+# reads up to count lines that end before the byte offset before (None for the end of the file)
+# reads backwards from there in blocks, so only the end of a big file ever gets read. returns the lines and the offset the first one starts at
+def readLogLinesBefore(path: str, before: Optional[int], count: int) -> tuple[list[str], int]:
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size if before is None else min(before, size)
+        start = end
+        data = b''
+        while start > 0 and data.count(b'\n') <= count:
+            blockSize = min(8192, start)
+            start -= blockSize
+            f.seek(start)
+            data = f.read(blockSize) + data
+
+    lines = data.split(b'\n')
+    if lines[-1] == b'':
+        # the file ends with a newline
+        lines.pop()
+    if start > 0:
+        # the first line started before the block we read
+        start += len(lines.pop(0)) + 1
+    while len(lines) > count:
+        start += len(lines.pop(0)) + 1
+    return [line.decode(errors='replace') for line in lines], start
+
+# gets count lines going backwards from cursor ('fileIndex:offset', or None for the newest lines), carrying on into older rotated files when one runs out
+# returns the lines oldest first, and the cursor for the page before them (None once the oldest file is done)
+# rotating moves every file up one, so a cursor from before a rotation just shows a few lines twice
+def readLogPage(cursor: Optional[str], count: int) -> tuple[list[str], Optional[str]]:
+    fileIndex, before = 0, None
+    if cursor:
+        fileIndex, _, offset = cursor.partition(':')
+        fileIndex, before = int(fileIndex), int(offset) if offset else None
+
+    lines = []
+    while len(lines) < count and fileIndex <= sketchShared.rootHandler.backupCount and os.path.exists(getLogFilePath(fileIndex)):
+        fileLines, start = readLogLinesBefore(getLogFilePath(fileIndex), before, count - len(lines))
+        lines = fileLines + lines
+        if start > 0:
+            return lines, f'{fileIndex}:{start}'
+        fileIndex, before = fileIndex + 1, None
+
+    if fileIndex <= sketchShared.rootHandler.backupCount and os.path.exists(getLogFilePath(fileIndex)):
+        return lines, f'{fileIndex}:'
+    return lines, None
+
+# the end of the file and its inode, for where a live tail starts from
+def getLogFileEnd(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_ino
+
+# reads everything written to the file since position, returns the data and the position and inode to read from next time
+# if the file has been rotated since (a different inode), the rest of the old file is read from its new name (path.1) before the new file from the top
+def readLogFrom(path: str, position: int, inode: int) -> tuple[bytes, int, int]:
+    with open(path, 'rb') as f:
+        currentInode = os.fstat(f.fileno()).st_ino
+        data = b''
+        if currentInode != inode:
+            try:
+                with open(f'{path}.1', 'rb') as rotated:
+                    if os.fstat(rotated.fileno()).st_ino == inode:
+                        rotated.seek(position)
+                        data = rotated.read()
+            except FileNotFoundError:
+                pass
+            position = 0
+        size = f.seek(0, os.SEEK_END)
+        if size < position:
+            # truncated rather than rotated
+            position = 0
+        f.seek(position)
+        newData = f.read(size - position)
+    return data + newData, position + len(newData), currentInode
 
 # MARK: EVENTS ------------------------------------------------------------------------------------------------------------
 
@@ -403,14 +609,8 @@ async def voiceLinkRedirect(request):
 
 # comment this out to hopefully not have to deal with the possibility that aiohttp parses an attack message? :(
 @routes.get('/')
-@aiohttp_jinja2.template('index.html')
+@timedTemplate('index.html')
 async def hello(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     messages = await getMessages(session)    
     csrfToken = await aiohttp_csrf.generate_token(request)
@@ -419,14 +619,32 @@ async def hello(request: aiohttp.web.Request):
     return {'messages': messages,'csrfToken': csrfToken, 'user': user}
 
 @routes.get('/admin/logs')
-@aiohttp_jinja2.template('logs.html')
+@timedTemplate('logs.html')
 async def logs(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
+    session = await getSession(request)
+    messages = await getMessages(session)    
+    csrfToken = await aiohttp_csrf.generate_token(request)
+    user = await validateDiscordAuth(session, request)
     
+    if user:
+        if user.id == sketchAuth.discordOwner:
+            try:
+                count = max(1, min(int(request.query.get('lines', logPageDefaultLines)), logPageMaxLines))
+                lines, olderCursor = await asyncio.to_thread(readLogPage, request.query.get('cursor'), count)
+            except ValueError:
+                raise aiohttp.web.HTTPBadRequest(text='invalid lines or cursor')
+            text = '\n'.join(lines).replace('\\n', '\n')
+            # the live tail can't use the session, it would need saving after the stream has already started
+            streamToken = secrets.token_urlsafe(32)
+            logStreamTokens.set(streamToken, user.id)
+            return {'messages': messages,'csrfToken': csrfToken, 'user': user, 'text': text, 'count': count, 'olderCursor': olderCursor, 'live': 'cursor' not in request.query, 'streamToken': streamToken}
+    
+    return aiohttp.web.HTTPSeeOther('/')
+
+# how long each route has been taking, split into queueing, the handler and rendering the template
+@routes.get('/admin/timings')
+@timedTemplate('timings.html')
+async def timings(request: aiohttp.web.Request):
     session = await getSession(request)
     messages = await getMessages(session)    
     csrfToken = await aiohttp_csrf.generate_token(request)
@@ -434,21 +652,39 @@ async def logs(request: aiohttp.web.Request):
     
     if user:
         if user.id == sketchAuth.discordOwner:
-            with open('./logs/sketch.log', 'r') as f:
-                text = f.read().replace('\\n', '\n')
-            return {'messages': messages,'csrfToken': csrfToken, 'user': user, 'text': text}
+            # slowest routes first
+            stats = sorted(routeTimingStats().items(), key=lambda item: item[1]['queue'] + item[1]['handler'] + item[1]['template'], reverse=True)
+            return {'messages': messages,'csrfToken': csrfToken, 'user': user, 'stats': stats}
     
     return aiohttp.web.HTTPSeeOther('/')
 
+# sends new log lines as server-sent events as they get written
+@routes.get('/admin/logs/stream')
+async def logsStream(request: aiohttp.web.Request):
+    if logStreamTokens.get(request.query.get('token')) != sketchAuth.discordOwner:
+        raise aiohttp.web.HTTPForbidden()
+    
+    response = aiohttp.web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    position, inode = await asyncio.to_thread(getLogFileEnd, sketchShared.rootHandler.baseFilename)
+    partial = b''
+    try:
+        while True:
+            await asyncio.sleep(1)
+            data, position, inode = await asyncio.to_thread(readLogFrom, sketchShared.rootHandler.baseFilename, position, inode)
+            if not data:
+                continue
+            # only whole lines get sent, the rest waits for the next read
+            *lines, partial = (partial + data).split(b'\n')
+            for line in lines:
+                await response.write(b'data: ' + line.replace(b'\\n', b'\ndata: ') + b'\n\n')
+    except ConnectionResetError:
+        pass
+    return response
+
 @routes.get('/login')
-@aiohttp_jinja2.template('login.html')
+@timedTemplate('login.html')
 async def login(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     messages = await getMessages(session)    
     csrfToken = await aiohttp_csrf.generate_token(request)
@@ -457,47 +693,25 @@ async def login(request: aiohttp.web.Request):
     return {'messages': messages,'csrfToken': csrfToken, 'user': user}
 
 @routes.get('/discord')
-@aiohttp_jinja2.template('discord.html')
+@timedTemplate('discord.html')
 async def discord(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     messages = await getMessages(session)    
     csrfToken = await aiohttp_csrf.generate_token(request)
     user = await validateDiscordAuth(session, request)
     
-    guilds = set()
+    guilds = []
     discordGuilds = {}
     if user:
-        ownedGuilds = await DiscordGuild.filter(owner=user.id)
-        for guild in ownedGuilds:
-            await guild.fetch_related('twitchAnnouncements')
-            await guild.fetch_related('authorizedUsers')
-            await guild.fetch_related('joinRoles')
-            discordGuilds[guild.id] = sketchDiscord.bot.get_guild(guild.id)
-            guilds.add(guild)
-        for guild in await user.authorizedGuilds.all():
-            await guild.fetch_related('twitchAnnouncements')
-            await guild.fetch_related('authorizedUsers')
-            await guild.fetch_related('joinRoles')
-            discordGuilds[guild.id] = sketchDiscord.bot.get_guild(guild.id)
-            guilds.add(guild)
-
-    return {'messages': messages,'csrfToken': csrfToken, 'user': user, 'guilds': guilds, 'discordGuilds': discordGuilds}
+        guilds = await loadDashboardGuilds(user)
+        for guild in guilds:
+            discordGuilds[guild['id']] = sketchDiscord.bot.get_guild(guild['id'])
+
+    return {'messages': messages,'csrfToken': csrfToken, 'user': user, 'guilds': guilds, 'discordGuilds': discordGuilds, 'backfills': sketchYoutube.backfillProgress}
 
 # /discord/config
 @routes.post('/discord/config')
 async def updateDiscordConfig(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -540,12 +754,6 @@ async def updateDiscordConfig(request: aiohttp.web.Request):
 # /discord/authorizedUser/add
 @routes.post('/discord/authorizedUser/add')
 async def addDiscordAuthorizedUser(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -570,6 +778,7 @@ async def addDiscordAuthorizedUser(request: aiohttp.web.Request):
             if dbUsers:
                 dbGuild = await DiscordGuild.get(id=data.get('guild'))
                 await dbGuild.authorizedUsers.add(*dbUsers)
+                sketchDiscord.authorizedUserCache.invalidate(dbGuild.id)
             session['messages'].append(f'<b class="success">Users authorized.</b><br>Users: {[addedUser.username for addedUser in dbUsers]}')
     
     return aiohttp.web.HTTPSeeOther('/discord')
@@ -577,12 +786,6 @@ async def addDiscordAuthorizedUser(request: aiohttp.web.Request):
 # /discord/authorizedUser/delete
 @routes.post('/discord/authorizedUser/delete')
 async def deleteDiscordAuthorizedUser(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -602,6 +805,7 @@ async def deleteDiscordAuthorizedUser(request: aiohttp.web.Request):
                 session['messages'].append(f'''<b class="error">Failed removing authorized user. (User or guild couldn't be fetched from database.)</b><br>Please try again, or contact alastairvox on discord.''')
             else:
                 await dbGuild.authorizedUsers.remove(dbUser)
+                sketchDiscord.authorizedUserCache.invalidate(dbGuild.id)
                 session['messages'].append(f'<b class="success">Authorized user removed.</b><br>User: {dbUser.username}')
         
     return aiohttp.web.HTTPSeeOther('/discord')
@@ -609,12 +813,6 @@ async def deleteDiscordAuthorizedUser(request: aiohttp.web.Request):
 # /discord/joinRole/add
 @routes.post('/discord/joinRole/add')
 async def addDiscordJoinRole(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -641,6 +839,7 @@ async def addDiscordJoinRole(request: aiohttp.web.Request):
                     dbRole.guild = dbGuild
                     await dbRole.save()
                     dbRoles.append(dbRole)
+            sketchDiscord.joinRoleCache.invalidate(dbGuild.id)
             
             session['messages'].append(f'<b class="success">Join Roles added.</b><br>Roles: {[addedRole.name + ' (' + str(addedRole.id) + ')' for addedRole in dbRoles]}')
     return aiohttp.web.HTTPSeeOther('/discord')
@@ -648,12 +847,6 @@ async def addDiscordJoinRole(request: aiohttp.web.Request):
 # /discord/joinRole/delete
 @routes.post('/discord/joinRole/delete')
 async def deleteDiscordJoinRole(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -672,18 +865,13 @@ async def deleteDiscordJoinRole(request: aiohttp.web.Request):
                 session['messages'].append(f'''<b class="error">Failed deleting Join Role. (You are not in guild's authorized user list.)</b><br>Please try again, or contact alastairvox on discord.''')
             else:
                 await role.delete()
+                sketchDiscord.joinRoleCache.invalidate(role.guild.id)
                 session['messages'].append(f'<b class="success">Join Role deleted.</b><br>Role: {role.name} ({role.id})')
     
     return aiohttp.web.HTTPSeeOther('/discord')
 
 @routes.post('/discord/announcement/add')
 async def addDiscordAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -708,17 +896,12 @@ async def addDiscordAnnouncement(request: aiohttp.web.Request):
                                                 guild=dbGuild,
                                                 channelID=data.get('channel'))
                 session['messages'].append(f'<b class="success">Twitch announcement created.</b><br>Stream: {data.get('streamName')}')
+                sketchTwitch.requestEventSubSync()
         
     return aiohttp.web.HTTPSeeOther('/discord')
 
 @routes.post('/discord/announcement/delete')
 async def deleteDiscordAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -738,17 +921,12 @@ async def deleteDiscordAnnouncement(request: aiohttp.web.Request):
             else:
                 await announcement.delete()
                 session['messages'].append(f'<b class="success">Twitch announcement deleted.</b><br>Stream: {data.get('streamName')}')
+                sketchTwitch.requestEventSubSync()
             
     return aiohttp.web.HTTPSeeOther('/discord')
     
 @routes.post('/discord/announcement/edit')
 async def updateDiscordAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -777,6 +955,7 @@ async def updateDiscordAnnouncement(request: aiohttp.web.Request):
                     announcement.channelID=data.get('channel')
                     await announcement.save()
                     session['messages'].append(f'<b class="success">Twitch announcement edited.</b><br>Stream: {data.get('streamName')}')
+                    sketchTwitch.requestEventSubSync()
 
     return aiohttp.web.HTTPSeeOther('/discord')
 
@@ -784,12 +963,6 @@ async def updateDiscordAnnouncement(request: aiohttp.web.Request):
 # youtubeChannel = 'UC-lHJZR3Gqxm24_Vd_AJ5Yw' # pewdiepie
 @routes.post('/discord/ytannouncement/add')
 async def addDiscordYTAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -812,19 +985,19 @@ async def addDiscordYTAnnouncement(request: aiohttp.web.Request):
                 guild=dbGuild
             )
             
-            if not ytChannel.announcedVideos:
+            if not await YoutubeVideo.filter(youtubeChannel=ytChannel).exists():
                 responseStatus = await sketchYoutube.gatherYoutubeVideos(ytChannel)
                 if responseStatus != 200:
                     session['messages'].append(f'<b class="error">Failed creating Youtube announcement. (Error {responseStatus} when attempting to get {data.get('ytChannelID')} from YouTube. Make sure you have provided a valid YouTube channel ID (like UC_0hyh6_G3Ct1k1EiqaorqQ).)</b><br>Please try again, or contact alastairvox on discord.')
-                    announcement.delete()
-                    ytChannel.delete()
+                    await announcement.delete()
+                    await ytChannel.delete()
                     return aiohttp.web.HTTPSeeOther('/discord')
                 else:
                     responseStatus = await sketchYoutube.subscribeToYoutubeUploads(ytChannel)
                     if responseStatus != 202:
                         session['messages'].append(f'<b class="error">Failed creating Youtube announcement. (Error {responseStatus} when attempting to get {data.get('ytChannelID')} from YouTube. Make sure you have provided a valid YouTube channel ID (like UC_0hyh6_G3Ct1k1EiqaorqQ).)</b><br>Please try again, or contact alastairvox on discord.')
-                        announcement.delete()
-                        ytChannel.delete()
+                        await announcement.delete()
+                        await ytChannel.delete()
                         return aiohttp.web.HTTPSeeOther('/discord')
             
             session['messages'].append(f'<b class="success">Youtube announcement created.</b><br>Channel: {data.get('ytChannelID')}')
@@ -834,12 +1007,6 @@ async def addDiscordYTAnnouncement(request: aiohttp.web.Request):
 # if deleting the last announcement for a channel, delete the channel as well so it doesn't get it's subscriptions renewed
 @routes.post('/discord/ytannouncement/delete')
 async def deleteDiscordYTAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -867,6 +1034,7 @@ async def deleteDiscordYTAnnouncement(request: aiohttp.web.Request):
                 if not oldChannel.youtubeAnnouncements:
                     info(f'deleting last announcement from ytChannel {announcement.youtubeChannel.id}')
                     await oldChannel.delete()
+                    sketchYoutube.leaseScheduler.cancel(oldChannel.id)
                     
                 session['messages'].append(f'<b class="success">Youtube announcement deleted.</b><br>Channel: {data.get('ytChannelID')}')
             
@@ -874,12 +1042,6 @@ async def deleteDiscordYTAnnouncement(request: aiohttp.web.Request):
     
 @routes.post('/discord/ytannouncement/edit')
 async def updateDiscordYTAnnouncement(request: aiohttp.web.Request):
-    debug('Responding to ' + str(request) +
-    ' from ' + str(request.remote) +
-    ' headers ' + str(request.headers) +
-    ' body ' + str(await request.text()) +
-    ' thats it :)')
-    
     session = await getSession(request)
     user = await validateDiscordAuth(session, request)
     
@@ -909,14 +1071,14 @@ async def updateDiscordYTAnnouncement(request: aiohttp.web.Request):
                 announcement.channelID = data.get('channel')
                 await announcement.save()
                 
-                if not ytChannel.announcedVideos:
+                if not await YoutubeVideo.filter(youtubeChannel=ytChannel).exists():
                     responseStatus = await sketchYoutube.gatherYoutubeVideos(ytChannel)
                     if responseStatus != 200:
                         session['messages'].append(f'<b class="error">Failed updating Youtube announcement. (Error {responseStatus} when attempting to get {data.get('ytChannelID')} from YouTube. Make sure you have provided a valid YouTube channel ID (like UC_0hyh6_G3Ct1k1EiqaorqQ).)</b><br>Please try again, or contact alastairvox on discord.')
                         if oldChannel:
                             announcement.youtubeChannel = oldChannel
                             await announcement.save()
-                        ytChannel.delete()
+                        await ytChannel.delete()
                         return aiohttp.web.HTTPSeeOther('/discord')
                     else:
                         responseStatus = await sketchYoutube.subscribeToYoutubeUploads(ytChannel)
@@ -925,7 +1087,7 @@ async def updateDiscordYTAnnouncement(request: aiohttp.web.Request):
                             if oldChannel:
                                 announcement.youtubeChannel = oldChannel
                                 await announcement.save()
-                            ytChannel.delete()
+                            await ytChannel.delete()
                             return aiohttp.web.HTTPSeeOther('/discord')
                 
                 if oldChannel:
@@ -935,6 +1097,7 @@ async def updateDiscordYTAnnouncement(request: aiohttp.web.Request):
                     if not oldChannel.youtubeAnnouncements:
                         info(f'removing last announcement from ytChannel {oldChannel.id}')
                         await oldChannel.delete()
+                        sketchYoutube.leaseScheduler.cancel(oldChannel.id)
                 
                 session['messages'].append(f'<b class="success">Twitch announcement edited.</b><br>Channel: {data.get('ytChannelID')}')
 
@@ -1006,6 +1169,23 @@ async def discordCallback(request: aiohttp.web.Request):
     # 303 response
     raise aiohttp.web.HTTPSeeOther('/login')
 
+# forgets the session in the database and the cache, so the cookie can't be used again
+@routes.post('/logout')
+async def logout(request: aiohttp.web.Request):
+    session = await getSession(request)
+    user = await validateDiscordAuth(session, request)
+    
+    if user:
+        info(f'Logging out discord user {user.id}')
+        authSessionCache.invalidate(user.id)
+        user.sessionID = None
+        user.state = None
+        await user.save(update_fields=['sessionID', 'state'])
+    
+    session = await newSession(request)
+    session['messages'].append('<b class="success">Logged out.</b>')
+    raise aiohttp.web.HTTPSeeOther('/login')
+
 # redirects user to google's oauth endpoint to begin oauth flow
 # https://developers.google.com/youtube/v3/guides/auth/server-side-web-apps#httprest_1
 @routes.get('/youtube/auth')
@@ -1075,7 +1255,6 @@ async def youtubeCallback(request: aiohttp.web.Request):
 # called by the hub to establish a new lease when subscribing to youtube uploads
 @routes.get('/youtube/{ytChannelID}')
 async def youtube(request: aiohttp.web.Request):
-    debug(f'Responding to {request}')
     if hasattr(request, 'query'):
         channel = request.query.get('hub.topic')
         if channel:
@@ -1096,9 +1275,8 @@ async def youtube(request: aiohttp.web.Request):
             }
             dbChannel, _ = await YoutubeChannel.update_or_create(id=channel, defaults=updates)
             
-            # CALL FUNCTION THAT AWAITS SLEEP FOR THE NUMBER OF SECONDS EQUAL TO the stored leaseSeconds (because i subtract 90 when storing) then calls the resubscribe, make a function that will look through all the stored youtube channels when discord starts, and calls the same function for each channel that has a leaseSeconds stored
-            loop = asyncio.get_event_loop()
-            loop.create_task(sketchYoutube.youtubeWaitForResub(leaseSeconds, dbChannel))
+            # moves the channel's renewal in the lease scheduler (leaseSeconds already has 90 seconds taken off), re-verifying never adds a second renewal
+            sketchYoutube.leaseScheduler.schedule(dbChannel.id, dbChannel.time + datetime.timedelta(seconds=leaseSeconds))
             info(f'Lease aquired for channel {channel}')
             return aiohttp.web.Response(status=200, text=hubChallenge)
         else:
@@ -1116,12 +1294,25 @@ async def youtubeUploadedNotification(request: aiohttp.web.Request):
     ytChannelID = request.match_info['ytChannelID']
     # store a copy of the youtube video number so i dont re-announce youtube videos if they just get updated: have to parse the xml of the text out for relevant bits
     # pass the text (xml, xml.etree.ElementTree?) to a discord function that parses out the author name, video title, URL (<link rel="alternate" href="), and the time published and then announces the stream
-    debug(f'Responding to {request} for {ytChannelID}')
-    # we add this to the end of the event loop so that we can return a response to the request right away, allowing us to respond and then process the data later
-    loop = asyncio.get_event_loop()
-    loop.create_task(sketchDiscord.announceYoutubeUpload(await request.read()))
+    # the notification is queued so that we can return a response to the request right away, and it gets announced by one of the discord workers later
+    if request.content_length and request.content_length > sketchDiscord.youtubeMaxNotificationBytes:
+        warn(f'Refusing youtube notification of {request.content_length} bytes for {ytChannelID}.')
+        return aiohttp.web.Response(status=413)
+    for video in sketchDiscord.parseYoutubeNotification(await request.read()):
+        if not sketchDiscord.youtubeNotificationQueue.submit(video):
+            # the hub delivers it again later if we don't answer with a 2xx, videos from it that did get queued are coalesced when it comes back
+            warn(f'Youtube notification queue is full, asking the hub to redeliver video {video["videoID"]}.')
+            return aiohttp.web.Response(status=503, headers={'Retry-After': '60'})
     return aiohttp.web.Response(status=200)
 
+# receives stream.online/stream.offline notifications (and subscription verifications) from twitch eventsub
+# https://dev.twitch.tv/docs/eventsub/handling-webhook-events/
+@routes.post('/twitch/eventsub')
+@aiohttp_csrf.csrf_exempt
+async def twitchEventSub(request: aiohttp.web.Request):
+    status, text = await sketchTwitch.handleEventSubMessage(request.headers, await request.read())
+    return aiohttp.web.Response(status=status, text=text)
+
 @routes.post('/test')
 async def test(request: aiohttp.web.Request):
     debug('Testing...')
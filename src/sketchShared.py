@@ -1,8 +1,6 @@
-import sys, io, datetime, traceback, inspect
+import sys, io, datetime, traceback, inspect, collections, time, queue, functools
 import logging, logging.handlers
-
-global sketchUncaughtException
-sketchUncaughtException = None
+from typing import Optional
 
 # defines a filter for discord that removes messages like "discord - GATEWAY: Shard ID None has successfully RESUMED session 1c0485fb65ae04fc3d585ac1779c23d1.""
 def filterDiscordShardResumes(record):
@@ -10,56 +8,54 @@ def filterDiscordShardResumes(record):
         return False
     return True
 
-# defines my own logging formatter class that manipulates module text and date format, as well as retrieves the actual raising module's name during an uncaught exception
+# how a module's name is shown in the log: uppercase, with the sketch prefix removed so its nicer to read (sketchDiscord > DISCORD, but sketch stays SKETCH)
+@functools.lru_cache(maxsize=256)
+def displayModuleName(module: str) -> str:
+    module = module.upper()
+    if module != 'SKETCH' and module.startswith('SKETCH'):
+        module = module.removeprefix('SKETCH')
+    return module
+
+# inspect.getmodulename, cached because stdout/stderr call it for every line printed
+@functools.lru_cache(maxsize=256)
+def moduleNameFromPath(path: str) -> Optional[str]:
+    return inspect.getmodulename(path)
+
+# defines my own logging formatter class that manipulates module text and date format, as well as showing the actual raising module's name for an uncaught exception
 class SketchLogFormatter(logging.Formatter):
-    # replaces default module with uppercase module, replaces "sketch" with main or removes it from prefix
-    def format(self, record):
-        global sketchUncaughtException
-        if sketchUncaughtException:
-            # get the stack info from the last traceback entry, and find filename
-            modulePath = traceback.extract_tb(sketchUncaughtException)[-1].filename
-            # find the module name from the filename path
-            moduleName = inspect.getmodulename(modulePath)
-            if moduleName:
-                # overwrite the record's module name with the real module name, because otherwise it will look like it's coming from here
-                record.module = moduleName
-        
-        record.module = record.module.upper()
-
-        if record.module != 'SKETCH' and record.module.startswith('SKETCH'):
-            # just remove sketch prefix from modules so its nicer to read
-            record.module = record.module.removeprefix('SKETCH')
-
-        if record.module == 'SHARED' and (record.name == 'stdout' or record.name == 'stderr'):
-            # replace level with STDOUT/STDERR and remove the module from the string format, because we append the real module during stdout/stderr redirection. if we dont do it that way, finding the calling function is wayyy harder
-            record.levelname = record.name.upper()
-            self._fmt = self._fmt.replace('%(module)s: ', '')
-            self._style._fmt = self._style._fmt.replace('%(module)s: ', '')
-        else:
-            if '%(module)s' not in self._fmt:
-                # set the string format back to normal if the module got removed from processing stdout/stderr previously
-                self._fmt = self._fmt.replace('%(message)s', '%(module)s: %(message)s')
-                self._style._fmt = self._style._fmt.replace('%(message)s', '%(module)s: %(message)s')
+    def __init__(self, fmt: str):
+        # every handler formats the same record, so the module, level and logger name we show are put in their own attributes instead of overwriting the real ones
+        fmt = fmt.replace('%(module)s', '%(sketchModule)s').replace('%(levelname)', '%(sketchLevel)').replace('%(name)s', '%(sketchName)s')
+        super().__init__(fmt)
+        # stdout/stderr leave the module out of the format, because we append the real module during stdout/stderr redirection. if we dont do it that way, finding the calling function is wayyy harder
+        self.stdStyle = logging.PercentStyle(fmt.replace('%(sketchModule)s: ', ''))
 
-        record.name = record.name.split('.', 1)[0]
+    def format(self, record):
+        # uncaught exceptions get logged from sketchShared, so handleUncaughtExceptions passes the real module along with the record
+        record.sketchModule = displayModuleName(getattr(record, 'uncaughtModule', None) or record.module)
+        record.sketchName = record.name.split('.', 1)[0]
+        # replace level with STDOUT/STDERR for stdout/stderr
+        record.sketchStd = record.sketchModule == 'SHARED' and (record.name == 'stdout' or record.name == 'stderr')
+        record.sketchLevel = record.name.upper() if record.sketchStd else record.levelname
 
         # call the original formatting function to handle adding time and etc.
-        orig = logging.Formatter.format(self, record)
-
-        # append the message prefix to any newlines that are going to be printed
-        splitOrig = orig.split('\n')
-        origPrefix = orig.partition(record.message)[0]
-        # if the module was removed, then we don't have an accurate one
-        if '%(module)s' not in self._fmt:
+        formatted = logging.Formatter.format(self, record)
+        if '\n' not in formatted:
+            return formatted
+
+        # append the message prefix to any newlines that are going to be printed, the message is always last in the format so the prefix is the format without it
+        message = record.message
+        record.message = ''
+        prefix = self.formatMessage(record)
+        record.message = message
+        if record.sketchStd:
             # have to get the module name from the message since we dont get it here
-            partMessage = record.message.partition(': ')
-            origPrefix = '\n' + origPrefix + partMessage[0] + partMessage[1]
-        else:
-            origPrefix = '\n' + origPrefix
-        if len(splitOrig) > 1:
-            # put the message back together with newlines and prefix appended
-            orig = origPrefix.join(splitOrig)
-        return orig
+            partMessage = message.partition(': ')
+            prefix += partMessage[0] + partMessage[1]
+        return formatted.replace('\n', '\n' + prefix)
+
+    def formatMessage(self, record):
+        return (self.stdStyle if record.sketchStd else self._style).format(record)
 
     # replaces default time formatting with RFC 3339 compliant format
     def formatTime(self, record, datefmt=None):
@@ -96,23 +92,95 @@ class LoggerWriter(io.IOBase):
         currentFrame = sys._getframe()
         if currentFrame:
             # gets the filename from the previous frame's code file
-            callingFramePath = currentFrame.f_back.f_code.co_filename
-            moduleName = inspect.getmodulename(callingFramePath)
+            moduleName = moduleNameFromPath(currentFrame.f_back.f_code.co_filename)
             if moduleName:
-                # massage the module name, then put it into the message
-                if moduleName != 'sketch' and moduleName.startswith('sketch'):
-                    moduleName = moduleName.removeprefix('sketch')
-                message = moduleName.upper() + ': ' + message
+                message = displayModuleName(moduleName) + ': ' + message
 
         # log the line and clear the buffer
         self.std_logger.log(self.level, message)
         self.buffer = []
 
-# stores uncaught exception traceback in a global variable so that it can be retrieved and used to get the actual raising module's name since python completely obliterates the stack and there is literally no way to get info about the current exception / previous exception if it was uncaught
+# a small cache where entries expire after ttl seconds, and the least recently used entry is dropped once there are more than maxSize
+class TTLCache:
+    # pass this as get's default to tell a missing key apart from a cached None
+    missing = object()
+
+    def __init__(self, ttl: float, maxSize: int = 1024):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        # {key: (expiryTime, value)}, ordered from least to most recently used
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key, self.missing)
+        if entry is self.missing or entry[0] <= time.monotonic():
+            if entry is not self.missing:
+                # expired
+                del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key) -> bool:
+        entry = self.entries.get(key, self.missing)
+        return entry is not self.missing and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+# puts records on a bounded queue for the listener thread to format and write, so logging never waits on the disk or console
+# when the queue is full, debug and info records are dropped if dropWhenFull (and counted, with a warning once there's room again), anything more important always waits for room
+class SketchQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, logQueue: queue.Queue, dropWhenFull: bool = True):
+        super().__init__(logQueue)
+        self.dropWhenFull = dropWhenFull
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.dropWhenFull and record.levelno < logging.WARNING:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+        else:
+            self.queue.put(record)
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.queue.put(logging.makeLogRecord({'name': 'root', 'levelno': logging.WARNING, 'levelname': 'WARNING', 'module': 'sketchShared', 'msg': f'Dropped {dropped} log messages because the log queue was full.'}))
+
+# stops the listener thread after it has written everything still queued, and puts the handlers straight on the root logger so anything logged after still gets out
+# safe to call more than once (exitHandler can be called by a signal and again by atexit)
+def stopLogging():
+    if queueHandler in rootLogger.handlers:
+        rootLogger.removeHandler(queueHandler)
+        queueListener.stop()
+        rootLogger.addHandler(rootHandler)
+        rootLogger.addHandler(console)
+
+# logs uncaught exceptions along with the actual raising module's name, since python completely obliterates the stack and the record would otherwise look like it came from here
 def handleUncaughtExceptions(eType, eValue, eTraceback):
-    global sketchUncaughtException
-    sketchUncaughtException = eTraceback
-    logging.critical("FATAL UNCAUGHT EXCEPTION:", exc_info=(eType, eValue, eTraceback))
+    # get the stack info from the last traceback entry, and find the module name from its filename
+    extracted = traceback.extract_tb(eTraceback)
+    moduleName = moduleNameFromPath(extracted[-1].filename) if extracted else None
+    logging.critical("FATAL UNCAUGHT EXCEPTION:", exc_info=(eType, eValue, eTraceback), extra={'uncaughtModule': moduleName})
 
 # set up the root file logger that the base and future loggers copy
 rootLogger = logging.getLogger()
@@ -128,9 +196,13 @@ console.setLevel(logging.DEBUG)
 consoleLogFormat = SketchLogFormatter('%(levelname)-8s %(name)s - %(module)s: %(message)s')
 console.setFormatter(consoleLogFormat)
 
-# add the file and console logger handlers to the root so they will always get output
-rootLogger.addHandler(rootHandler)
-rootLogger.addHandler(console)
+# the file and console handlers run on the listener's thread, the root logger only puts records on the queue so it never blocks the event loop
+logQueueSize = 10000
+logQueue = queue.Queue(logQueueSize)
+queueHandler = SketchQueueHandler(logQueue)
+queueListener = logging.handlers.QueueListener(logQueue, rootHandler, console, respect_handler_level=True)
+rootLogger.addHandler(queueHandler)
+queueListener.start()
 
 # overriding stdout and stderr to write to the root logger, the levels I set dont really matter because I override them in the formatter with STDOUT/STDERR instead of info/error. the original stdout/stderr are at sys.__stdout__ and sys.__stderr__ if needed
 sys.stdout = LoggerWriter("stdout", logging.INFO)
@@ -1,6 +1,6 @@
 import sketchShared
 from sketchShared import debug, info, warn, error, critical
-import twitchio, twitchio.ext.commands, asyncio, traceback, logging
+import twitchio, twitchio.ext.commands, twitchio.eventsub, asyncio, traceback, logging, functools, heapq, hmac, hashlib, json, datetime, collections, dateutil.parser
 import sketchAuth, sketchDiscord
 from sketchModels import *
 
@@ -18,11 +18,112 @@ bot = twitchio.ext.commands.Bot(
 
 logging.getLogger("twitchio").setLevel(logging.INFO)
 
+# twitch only accepts 100 user ids per get streams request, so anything over that has to be split into batches
+streamBatchSize = 100
+# how many of those batches are allowed to be requested from twitch at the same time, can be overridden in sketchAuth
+streamBatchConcurrency = getattr(sketchAuth, 'twitchStreamBatchConcurrency', 4)
+
+# twitch user profile/offline images barely change, so remember them for a while instead of asking twitch every time someone goes live
+# {'streamID': (profileImageURL, offlineImageURL)}
+userImageCache = sketchShared.TTLCache(ttl=3600, maxSize=5000)
+
+# game names and box art almost never change, so keep them around for a day
+# {'gameID': twitchio.Game}, games twitch doesn't know about are cached as None for a shorter time
+gameCache = sketchShared.TTLCache(ttl=86400, maxSize=2000)
+gameCacheMissingTTL = 600
+
+# eventsub mode is turned on by putting a secret in sketchAuth, twitch signs every webhook message with it
+eventSubSecret = getattr(sketchAuth, 'twitchEventSubSecret', None)
+# twitch only accepts secrets of 10 to 100 characters, and twitchio refuses anything else on every subscribe
+if eventSubSecret and not 10 <= len(eventSubSecret) <= 100:
+    error('twitchEventSubSecret must be 10 to 100 characters long, EventSub is turned off until it is fixed.')
+    eventSubSecret = None
+# with eventsub on, polling only has to catch anything eventsub missed so it can be a lot slower
+eventSubReconcileSeconds = 300
+eventSubTypes = ('stream.online', 'stream.offline')
+# twitch can deliver the same message more than once, so remember the last few message ids
+eventSubRecentMessages: collections.OrderedDict[str, None] = collections.OrderedDict()
+eventSubRecentMessagesMax = 1000
+# keep references to running notification tasks so they don't get garbage collected mid-run
+eventSubTasks: set[asyncio.Task] = set()
+eventSubSyncLock = asyncio.Lock()
+# polling and eventsub both announce, so only one of them can be working on announcements at a time or a stream could get announced twice
+notifyLock = asyncio.Lock()
+
+# fires the delayed offline edit/delete for each announcement exactly once, when its spamProtectionAnnounceDelay runs out
+# deadlines come from TwitchAnnouncement.ended, so anything still waiting when sketch restarts is picked back up from the database
+class OfflineScheduler:
+    def __init__(self):
+        # (deadline, announcementID), heapq keeps the soonest deadline first
+        self.heap: list[tuple[datetime.datetime, int]] = []
+        # {announcementID: deadline}, the real list of what's scheduled. cancelling or rescheduling only changes this, old heap entries just get skipped when they come up
+        self.deadlines: dict[int, datetime.datetime] = {}
+        self.wakeup = asyncio.Event()
+
+    def schedule(self, announcementID: int, deadline: datetime.datetime):
+        self.deadlines[announcementID] = deadline
+        heapq.heappush(self.heap, (deadline, announcementID))
+        # the new deadline might be sooner than the one currently being waited on
+        self.wakeup.set()
+
+    def cancel(self, announcementID: int):
+        self.deadlines.pop(announcementID, None)
+
+    def __contains__(self, announcementID: int) -> bool:
+        return announcementID in self.deadlines
+
+    # schedules every announcement that was waiting out its delay (has a message and an ended time)
+    async def reload(self):
+        for announcement in await TwitchAnnouncement.filter(ended__not_isnull=True, messageID__not_isnull=True).select_related('guild'):
+            self.schedule(announcement.id, announcement.ended + datetime.timedelta(minutes=announcement.guild.spamProtectionAnnounceDelay))
+        info(f'Reloaded {len(self.deadlines)} pending offline announcement removals.')
+
+    async def run(self):
+        await bot.wait_until_ready()
+        await sketchDiscord.bot.wait_until_ready()
+        await self.reload()
+        while True:
+            try:
+                # throw away entries that were cancelled or rescheduled
+                while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                    heapq.heappop(self.heap)
+
+                self.wakeup.clear()
+                if not self.heap:
+                    await self.wakeup.wait()
+                    continue
+
+                deadline, announcementID = self.heap[0]
+                delay = (deadline - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                heapq.heappop(self.heap)
+                del self.deadlines[announcementID]
+                await self.fire(announcementID)
+            except Exception:
+                error(traceback.format_exc())
+
+    async def fire(self, announcementID: int):
+        async with notifyLock:
+            # reload it, it could have gone live again or been deleted while waiting
+            announcement = await TwitchAnnouncement.get_or_none(id=announcementID).select_related('guild')
+            if not announcement or not announcement.ended or not announcement.messageID:
+                return
+            await sketchDiscord.removeAnnouncement(announcement)
+
+offlineScheduler = OfflineScheduler()
+
 # starts the bot when called
 async def summon():
     info("Summoning...")
     loop = asyncio.get_running_loop()
     loop.create_task(checkStreams())
+    loop.create_task(offlineScheduler.run())
     await bot.start()
     
 
@@ -30,105 +131,357 @@ async def summon():
 # -------------------------------------------------------------------------------------------------------------------------
 # -------------------------------------------------------------------------------------------------------------------------
 
+# polls twitch for live streams, when eventsub is on this is only a slow reconciliation in case a notification was missed
 async def checkStreams():
     while True:
         try:
             if sketchShared.dev:
                 await asyncio.sleep(7)
+            elif eventSubSecret:
+                await asyncio.sleep(eventSubReconcileSeconds)
             else:
                 await asyncio.sleep(30)
             
             await bot.wait_until_ready()
             await sketchDiscord.bot.wait_until_ready()
 
-            streamsToCheck = await getStreamsToCheck()
-            if not streamsToCheck:
-                # restarts the loop from the top (so waits, then checks again)
-                continue
-            
-            try:
-                response = await bot.fetch_streams(user_ids=[stream.streamID for stream in streamsToCheck], first=100)
-            except twitchio.HTTPException as error:
-                error('HTTPException getting stream information: ' + str(error))
-                continue
-            else:
-                await notifyStreams(response)
+            if eventSubSecret:
+                await syncEventSubSubscriptions()
+
+            async with notifyLock:
+                snapshot = await getStreamsToCheck()
+                if not snapshot.announcements:
+                    # restarts the loop from the top (so waits, then checks again)
+                    continue
+                
+                try:
+                    response = await fetchLiveStreams(snapshot.streamIDs())
+                except twitchio.HTTPException as err:
+                    error('HTTPException getting stream information: ' + str(err))
+                    continue
+                else:
+                    await notifyStreams(response, snapshot)
         
-        except Exception as error:
-            error(traceback.print_exc())
+        except Exception as err:
+            error(traceback.format_exc())
             continue
+
+# gets the live streams for every id passed in, no matter how many there are
+# ids are deduped then split into batches of 100 (twitch's limit per request), and the batches are requested at the same time (up to streamBatchConcurrency at once) so a poll takes about the same time no matter how many channels we track
+async def fetchLiveStreams(streamIDs: list) -> list[twitchio.Stream]:
+    # dict.fromkeys dedupes while keeping the original order
+    uniqueIDs = list(dict.fromkeys(str(streamID) for streamID in streamIDs))
+    batches = [uniqueIDs[i:i+streamBatchSize] for i in range(0, len(uniqueIDs), streamBatchSize)]
+    limiter = asyncio.Semaphore(streamBatchConcurrency)
+
+    async def fetchBatch(batch: list[str]) -> list[twitchio.Stream]:
+        async with limiter:
+            return await bot.fetch_streams(user_ids=batch, first=streamBatchSize)
+
+    # if any batch fails the whole poll is skipped (same as before), otherwise streams that are live would look offline and get their announcements removed
+    responses = await asyncio.gather(*[fetchBatch(batch) for batch in batches])
+
+    # merge the batches back together, a stream should only ever be in one batch but dedupe just in case
+    liveStreams = {}
+    for response in responses:
+        for stream in response:
+            liveStreams[stream.user.id] = stream
+    debug(f'Checked {len(uniqueIDs)} streams in {len(batches)} batches, {len(liveStreams)} live.')
+    return list(liveStreams.values())
         
-async def getStreamsToCheck() -> list[TwitchAnnouncement]:
-    streams = []
-    for stream in await TwitchAnnouncement.filter(streamID__not_isnull=True):
-        if stream in streams:
-            # stream already added, next stream
-            continue
-        # includes announcements that have a message already, and ones that don't
-        streams.append(stream)
-    return streams
+# every twitch announcement (with its guild already joined) loaded once for a single poll cycle, indexed so nothing in the cycle has to go back to the database or scan a list to find an announcement
+class AnnouncementSnapshot:
+    def __init__(self, announcements: list[TwitchAnnouncement]):
+        self.announcements = announcements
+        # several guilds can announce the same stream, so each streamID holds a list
+        # {'streamID': [TwitchAnnouncement, TwitchAnnouncement]}
+        self.byStreamID: dict[str, list[TwitchAnnouncement]] = {}
+        # {announcementID: TwitchAnnouncement}
+        self.byID: dict[int, TwitchAnnouncement] = {}
+        for announcement in announcements:
+            # twitchio gives ids back as strings, so index by string to match
+            self.byStreamID.setdefault(str(announcement.streamID), []).append(announcement)
+            self.byID[announcement.id] = announcement
+
+    # unique streamIDs in this snapshot
+    def streamIDs(self) -> list[str]:
+        return list(self.byStreamID)
+
+# loads the snapshot in one query, optionally only for some streams
+async def loadAnnouncementSnapshot(streamIDs: list = None) -> AnnouncementSnapshot:
+    query = TwitchAnnouncement.filter(streamID__not_isnull=True)
+    if streamIDs is not None:
+        query = query.filter(streamID__in=[int(streamID) for streamID in streamIDs])
+    return AnnouncementSnapshot(await query.select_related('guild'))
 
-async def notifyStreams(streams: list[twitchio.Stream]):
-    streamIDs = []
+# includes announcements that have a message already, and ones that don't
+async def getStreamsToCheck() -> AnnouncementSnapshot:
+    return await loadAnnouncementSnapshot()
+
+async def notifyStreams(streams: list[twitchio.Stream], snapshot: AnnouncementSnapshot):
     streamsToAnnounce = []
     games = []
-    users = []
-    for stream in streams:
-        streamIDs.append(stream.user.id)
+    # dict keys so a stream announced in several guilds is only fetched once
+    users = {}
+    # {'streamID': twitchio.Stream}
+    liveStreams = {stream.user.id: stream for stream in streams}
         
-    for announcement in await TwitchAnnouncement.filter(streamID__not_isnull=True):
+    for announcement in snapshot.announcements:
         messageID = announcement.messageID
         streamID = str(announcement.streamID)
-        if not messageID and streamID in streamIDs:
+        stream = liveStreams.get(streamID)
+        if not messageID and stream:
             # stream has no announcement, but is in the list of live streams, so announce
-            # because the streamIDs list is made from the streams list, the stream object is at the same index as the ID
-            stream = streams[streamIDs.index(streamID)]
             if stream.game_id:
                 # add the game to a list so that we can get the game image and etc. from twitch later
                 games.append(stream.game_id)
             # add the user to a list so we can get their profile image and etc. from twitch later
-            users.append(streamID)
+            users[streamID] = None
             # associate the db entry and the twitchio stream object, so we can reference both later
             streamsToAnnounce.append({'dbStream': announcement, 'twitchioStream': stream})
-        elif messageID and streamID not in streamIDs:
+        elif messageID and not stream:
             # stream had an announcement, but is not in the list of live streams, so remove/edit its announcement
-            # if the stream doesn't have an "ended" attribute, then it isn't being delayed due to spam ping protection, so log that it's newly offline
-            if not announcement.ended:
-                info(announcement.streamName + ' went offline...')
-            await sketchDiscord.removeAnnouncement(announcement)
-        elif messageID and streamID in streamIDs and announcement.ended:
+            if announcement.ended:
+                # already went offline and is waiting out spam ping protection, the offline scheduler will remove it when the delay is up
+                if announcement.id not in offlineScheduler:
+                    offlineScheduler.schedule(announcement.id, announcement.ended + datetime.timedelta(minutes=announcement.guild.spamProtectionAnnounceDelay))
+                continue
+            info(announcement.streamName + ' went offline...')
+            # if this is not 0 (python treats a 0 value int as False) then theres a delay
+            spamProtectionAnnounceDelay = announcement.guild.spamProtectionAnnounceDelay
+            if spamProtectionAnnounceDelay:
+                announcement.ended = datetime.datetime.now(datetime.timezone.utc)
+                await announcement.save(update_fields=['ended'])
+                offlineScheduler.schedule(announcement.id, announcement.ended + datetime.timedelta(minutes=spamProtectionAnnounceDelay))
+                info(f'Delaying removal due to spamProtectionAnnounceDelay on {announcement.guild.name}.')
+            else:
+                await sketchDiscord.removeAnnouncement(announcement)
+        elif messageID and stream and announcement.ended:
             # going live, but there's an "ended" entry for the stream, so removal was being delayed due to spam ping protection and they went live again within the time limit
             info(announcement.streamName + ' went live again within grace period.')
+            offlineScheduler.cancel(announcement.id)
             announcement.ended = None
-            announcement.save(update_fields=['ended'])
+            await announcement.save(update_fields=['ended'])
             
     # get information about the games that are being played, including game name and game image
-    if games:
-        games = await bot.fetch_games(ids=games)
+    games = await getGames(games)
 
     # get information about the users being announced, including profile image and the user offline image
     if users:
-        # cannot fetch more than 100 users at a time...
-        fullUsers: list[twitchio.User] = []
-        for i in range(0, len(users), 100):
-            # slicing beyond the end of the list gets the remaining items correctly (no errors)
-            subList = users[i:i+100]
-            response = await bot.fetch_users(ids=subList)
-            fullUsers.extend(response)
-        for user in fullUsers:
-            profileImage = user.profile_image
-            if profileImage:
-                profileImage = user.profile_image.base_url
-            offlineImage = user.offline_image
-            if offlineImage:
-                offlineImage = user.offline_image.base_url
-            await TwitchAnnouncement.filter(streamID=user.id).update(profileImageURL=profileImage, offlineImageURL=offlineImage)
+        await refreshUserImages(list(users), snapshot)
     
+    jobs = []
     for stream in streamsToAnnounce: 
-        game = {'name': 'No Game or Unknown'}
-        for gameResponse in games:
-            if stream['twitchioStream'].game_id == gameResponse.id:
-                game = gameResponse
-                break
+        game = games.get(stream['twitchioStream'].game_id)
         info(stream['dbStream'].streamName + ' is live unannounced...')
-        await sketchDiscord.makeAnnouncement(stream['dbStream'], stream['twitchioStream'], game)
\ No newline at end of file
+        jobs.append((stream['dbStream'].channelID, functools.partial(sketchDiscord.makeAnnouncement, stream['dbStream'], stream['twitchioStream'], game)))
+    # announce to every guild at once rather than one after another
+    await sketchDiscord.announcementDispatcher.submitAll(jobs)
+
+# gets the profile and offline images for streams (from the cache when it's fresh, otherwise from twitch) and saves only the announcements whose images actually changed
+async def refreshUserImages(streamIDs: list[str], snapshot: AnnouncementSnapshot):
+    # {'streamID': (profileImageURL, offlineImageURL)}
+    userImages = {}
+    missing = []
+    for streamID in streamIDs:
+        images = userImageCache.get(streamID)
+        if images:
+            userImages[streamID] = images
+        else:
+            missing.append(streamID)
+
+    # cannot fetch more than 100 users at a time...
+    for i in range(0, len(missing), 100):
+        # slicing beyond the end of the list gets the remaining items correctly (no errors)
+        for user in await bot.fetch_users(ids=missing[i:i+100]):
+            profileImage = user.profile_image.base_url if user.profile_image else None
+            offlineImage = user.offline_image.base_url if user.offline_image else None
+            userImages[user.id] = (profileImage, offlineImage)
+            userImageCache.set(user.id, userImages[user.id])
+
+    changed = []
+    for streamID, (profileImage, offlineImage) in userImages.items():
+        # update the snapshot too, so the announcement uses the new images
+        for announcement in snapshot.byStreamID.get(streamID, []):
+            if announcement.profileImageURL != profileImage or announcement.offlineImageURL != offlineImage:
+                announcement.profileImageURL = profileImage
+                announcement.offlineImageURL = offlineImage
+                changed.append(announcement)
+    if changed:
+        # a single UPDATE covering every changed row
+        await TwitchAnnouncement.bulk_update(changed, fields=['profileImageURL', 'offlineImageURL'])
+        debug(f'Updated images for {len(changed)} Twitch announcements.')
+
+# gets games by id, from the cache when possible, only asking twitch for the ones it doesn't have (in batches of 100, the most twitch allows)
+async def getGames(gameIDs: list[str]) -> dict[str, twitchio.Game]:
+    # {'gameID': twitchio.Game}
+    games = {}
+    missing = []
+    for gameID in dict.fromkeys(gameIDs):
+        game = gameCache.get(gameID, gameCache.missing)
+        if game is gameCache.missing:
+            missing.append(gameID)
+        elif game:
+            games[gameID] = game
+
+    for i in range(0, len(missing), 100):
+        batch = missing[i:i+100]
+        for game in await bot.fetch_games(ids=batch):
+            games[game.id] = game
+            gameCache.set(game.id, game)
+        for gameID in batch:
+            if gameID not in games:
+                gameCache.set(gameID, None, ttl=gameCacheMissingTTL)
+
+    if gameIDs:
+        debug(f'Game cache: {gameCache.hits} hits, {gameCache.misses} misses, {len(gameCache)} cached.')
+    return games
+
+# MARK: EVENTSUB ----------------------------------------------------------------------------------------------------------
+
+def getEventSubCallbackURL() -> str:
+    baseCallbackURL = sketchAuth.devPublicCallbackURL if sketchShared.dev else sketchAuth.baseCallbackURL
+    return f'{baseCallbackURL}twitch/eventsub'
+
+# makes twitch's stream.online/stream.offline webhook subscriptions match the streams in the TwitchAnnouncement table
+# subscribes to anything missing and removes subscriptions for streams nobody announces anymore
+async def syncEventSubSubscriptions():
+    if not eventSubSecret:
+        return
+    async with eventSubSyncLock:
+        try:
+            await syncEventSubSubscriptionsLocked()
+        except Exception:
+            error('Failed syncing EventSub subscriptions: ' + traceback.format_exc())
+
+async def syncEventSubSubscriptionsLocked():
+    callbackURL = getEventSubCallbackURL()
+    wanted = {(subType, streamID) for streamID in await getTrackedStreamIDs() for subType in eventSubTypes}
+
+    # {(type, streamID): subscriptionID}
+    existing = {}
+    response = await bot.fetch_eventsub_subscriptions()
+    async for subscription in response.subscriptions:
+        if subscription.type not in eventSubTypes or subscription.transport.callback != callbackURL:
+            continue
+        key = (subscription.type, str(subscription.condition.get('broadcaster_user_id')))
+        if subscription.status in ('enabled', 'webhook_callback_verification_pending') and key in wanted and key not in existing:
+            existing[key] = subscription.id
+        else:
+            # failed, revoked, duplicated or no longer needed
+            debug(f'Deleting EventSub subscription {subscription.id} ({subscription.type} for {key[1]}, {subscription.status}).')
+            await bot.delete_eventsub_subscription(subscription.id)
+
+    for subType, streamID in wanted - existing.keys():
+        if subType == 'stream.online':
+            payload = twitchio.eventsub.StreamOnlineSubscription(broadcaster_user_id=streamID)
+        else:
+            payload = twitchio.eventsub.StreamOfflineSubscription(broadcaster_user_id=streamID)
+        try:
+            await bot.subscribe_webhook(payload=payload, callback_url=callbackURL, eventsub_secret=eventSubSecret)
+            info(f'Subscribed to EventSub {subType} for {streamID}.')
+        except twitchio.HTTPException as err:
+            error(f'Failed subscribing to EventSub {subType} for {streamID}: ' + str(err))
+
+async def getTrackedStreamIDs() -> set[str]:
+    return {str(streamID) for streamID in await TwitchAnnouncement.filter(streamID__not_isnull=True).distinct().values_list('streamID', flat=True)}
+
+# called when announcements are added, edited or deleted so the subscriptions follow along without waiting for the next reconciliation
+def requestEventSubSync():
+    if eventSubSecret:
+        task = asyncio.get_running_loop().create_task(syncEventSubSubscriptions())
+        eventSubTasks.add(task)
+        task.add_done_callback(eventSubTasks.discard)
+
+# checks that a webhook message really came from twitch: an hmac of the message id, timestamp and body signed with our secret
+def verifyEventSubSignature(headers, body: bytes) -> bool:
+    messageID = headers.get('Twitch-Eventsub-Message-Id', '')
+    timestamp = headers.get('Twitch-Eventsub-Message-Timestamp', '')
+    signature = headers.get('Twitch-Eventsub-Message-Signature', '')
+    expected = 'sha256=' + hmac.new(eventSubSecret.encode(), messageID.encode() + timestamp.encode() + body, hashlib.sha256).hexdigest()
+    # compared as bytes, since compare_digest refuses str with anything but ascii in it and the header could hold anything
+    return hmac.compare_digest(expected.encode(), signature.encode(errors='replace'))
+
+# handles one webhook message from twitch (or anything pretending to be twitch that knows the secret, like a local test sender)
+# returns the status and text to respond with, twitch wants a 2xx within a few seconds so the actual announcing is done in a task
+async def handleEventSubMessage(headers, body: bytes) -> tuple[int, str]:
+    if not eventSubSecret:
+        return 404, 'eventsub is not enabled'
+    if not verifyEventSubSignature(headers, body):
+        warn('EventSub message with invalid signature, ignoring.')
+        return 403, 'invalid signature'
+
+    # twitch recommends rejecting anything older than 10 minutes to stop replays
+    try:
+        timestamp = dateutil.parser.isoparse(headers.get('Twitch-Eventsub-Message-Timestamp'))
+    except (TypeError, ValueError):
+        return 400, 'invalid timestamp'
+    # twitch always sends utc, and one without an offset can't be compared with the current time
+    if timestamp.tzinfo is None:
+        return 400, 'invalid timestamp'
+    if abs(datetime.datetime.now(datetime.timezone.utc) - timestamp) > datetime.timedelta(minutes=10):
+        warn('EventSub message is too old, ignoring.')
+        return 403, 'message too old'
+
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return 400, 'invalid body'
+    if not isinstance(data, dict):
+        return 400, 'invalid body'
+
+    messageID = headers.get('Twitch-Eventsub-Message-Id')
+    if messageID in eventSubRecentMessages:
+        debug(f'Duplicate EventSub message {messageID}, ignoring.')
+        return 204, ''
+    eventSubRecentMessages[messageID] = None
+    if len(eventSubRecentMessages) > eventSubRecentMessagesMax:
+        eventSubRecentMessages.popitem(last=False)
+
+    messageType = headers.get('Twitch-Eventsub-Message-Type')
+    subscription = data.get('subscription', {})
+
+    if messageType == 'webhook_callback_verification':
+        info(f'EventSub {subscription.get("type")} subscription verified for {subscription.get("condition", {}).get("broadcaster_user_id")}.')
+        if not isinstance(data.get('challenge'), str):
+            return 400, 'missing challenge'
+        return 200, data['challenge']
+    elif messageType == 'revocation':
+        warn(f'EventSub {subscription.get("type")} subscription revoked ({subscription.get("status")}), will resubscribe on next sync.')
+        return 204, ''
+    elif messageType == 'notification':
+        streamID = str(data.get('event', {}).get('broadcaster_user_id'))
+        task = asyncio.get_running_loop().create_task(handleEventSubNotification(subscription.get('type'), streamID))
+        eventSubTasks.add(task)
+        task.add_done_callback(eventSubTasks.discard)
+        return 204, ''
+
+    return 400, 'unknown message type'
+
+# runs the same announce/remove logic as polling, but only for the one stream the notification was about
+async def handleEventSubNotification(subscriptionType: str, streamID: str):
+    try:
+        await bot.wait_until_ready()
+        await sketchDiscord.bot.wait_until_ready()
+        if subscriptionType == 'stream.online':
+            info(f'EventSub: {streamID} went online.')
+            # the streams endpoint can lag behind the notification by a few seconds, so try a couple times before leaving it for the reconciliation poll
+            for attempt in range(3):
+                async with notifyLock:
+                    snapshot = await loadAnnouncementSnapshot([streamID])
+                    if not snapshot.announcements:
+                        return
+                    streams = await fetchLiveStreams([streamID])
+                    if streams:
+                        await notifyStreams(streams, snapshot)
+                        return
+                await asyncio.sleep(10)
+            warn(f'EventSub: {streamID} went online but twitch has no stream for them yet, leaving it for the next poll.')
+        elif subscriptionType == 'stream.offline':
+            info(f'EventSub: {streamID} went offline.')
+            async with notifyLock:
+                snapshot = await loadAnnouncementSnapshot([streamID])
+                # no live streams, so everything in the snapshot with a message gets removed
+                await notifyStreams([], snapshot)
+    except Exception:
+        error(traceback.format_exc())
@@ -1,6 +1,7 @@
 import sketchShared
 from sketchShared import debug, info, warn, error, critical
-import asyncio, datetime, dateutil
+import asyncio, datetime, dateutil, dateutil.parser, traceback, heapq, random
+from tortoise.transactions import in_transaction
 import sketchAuth, sketchServer
 from sketchModels import *
 
@@ -31,28 +32,135 @@ ytTestChannel = 'UCmkonxPPduKnLNWvqhoHl_g'
 # o subscribe to the channel for video updates so that we are notified when a video might be changing schedule / becoming private / unlisted
 #   - update the video in the database when notified about it
 
-# subscribes to every channel in database for notifications about new videos from youtube
-async def youtubePrepareAllResubs():
-    loop = asyncio.get_event_loop()
-    async for channel in YoutubeChannel.all():
-        leaseSeconds = channel.leaseSeconds
-        timeAdded = channel.time
-        if leaseSeconds and timeAdded:
-            leaseSecondsDelta = datetime.timedelta(seconds=leaseSeconds)
-            timeNow = datetime.datetime.now(datetime.timezone.utc)
-            timeDifference = timeNow - timeAdded
-            if timeDifference >= leaseSecondsDelta:
-                # resub immediately
-                loop.create_task(subscribeToYoutubeUploads(channel))
-            else:
-                timeDifference = leaseSecondsDelta - timeDifference
-                loop.create_task(youtubeWaitForResub(timeDifference.total_seconds(), channel))
-
-# waits to re-subscribe until subscription expiry
-async def youtubeWaitForResub(seconds, youtubeChannel: YoutubeChannel):
-    info(f'waiting {seconds} seconds to resub to {youtubeChannel.id}')
-    await asyncio.sleep(seconds)
-    await subscribeToYoutubeUploads(youtubeChannel)
+# youtube channels whose existing videos are still being collected, for showing progress on the dashboard
+# {'ytChannelID': YoutubeBackfill}
+backfillProgress: dict[str, YoutubeBackfill] = {}
+# {'ytChannelID': asyncio.Task}
+backfillTasks: dict[str, asyncio.Task] = {}
+# how many errors in a row before a backfill gives up until the next restart
+backfillMaxFailures = 5
+
+# renews the websub leases for every youtube channel from one task, instead of a sleeping task per channel
+# leases are kept in a heap ordered by when they should be renewed, with one entry per channel so re-verifying a channel just moves its renewal
+class LeaseScheduler:
+    def __init__(self, batchSize: int, concurrency: int, jitterSeconds: int, retrySeconds: int):
+        # (renewAt, ytChannelID), heapq keeps the soonest renewal first
+        self.heap: list[tuple[datetime.datetime, str]] = []
+        # {ytChannelID: renewAt}, the real list of what's scheduled. rescheduling or cancelling only changes this, old heap entries just get skipped when they come up
+        self.renewals: dict[str, datetime.datetime] = {}
+        # {ytChannelID: expiry}, when the hub will stop sending notifications if the lease isn't renewed
+        self.expiries: dict[str, datetime.datetime] = {}
+        # channels with a subscribe request to the hub in progress
+        self.renewing: set[str] = set()
+        self.wakeup = asyncio.Event()
+        self.batchSize = batchSize
+        self.jitterSeconds = jitterSeconds
+        self.retrySeconds = retrySeconds
+        self.hubLimit = asyncio.Semaphore(concurrency)
+
+    # schedules the renewal for a lease that expires at expiry, somewhere in the jitter window before it so channels that subscribed together don't all renew together
+    def schedule(self, ytChannelID: str, expiry: datetime.datetime):
+        self.expiries[ytChannelID] = expiry
+        self.push(ytChannelID, expiry - datetime.timedelta(seconds=random.uniform(0, self.jitterSeconds)))
+
+    def push(self, ytChannelID: str, renewAt: datetime.datetime):
+        self.renewals[ytChannelID] = renewAt
+        heapq.heappush(self.heap, (renewAt, ytChannelID))
+        # the new renewal might be sooner than the one currently being waited on
+        self.wakeup.set()
+
+    def cancel(self, ytChannelID: str):
+        self.renewals.pop(ytChannelID, None)
+        self.expiries.pop(ytChannelID, None)
+
+    def __contains__(self, ytChannelID: str) -> bool:
+        return ytChannelID in self.renewals
+
+    # {'pending': leases waiting to be renewed, 'overdue': leases that have already expired without being renewed}
+    def stats(self) -> dict:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {
+            'pending': len(self.expiries),
+            'overdue': sum(1 for expiry in self.expiries.values() if expiry <= now),
+            'renewing': len(self.renewing)
+        }
+
+    # schedules every channel in the database that has a lease, the ones that have already expired get renewed straight away
+    async def reload(self):
+        async for channel in YoutubeChannel.filter(leaseSeconds__not_isnull=True, time__not_isnull=True):
+            self.schedule(channel.id, channel.time + datetime.timedelta(seconds=channel.leaseSeconds))
+        info(f'Loaded {len(self.expiries)} youtube leases, {self.stats()["overdue"]} already expired.')
+
+    async def run(self):
+        await self.reload()
+        while True:
+            try:
+                # throw away entries that were cancelled or rescheduled
+                while self.heap and self.renewals.get(self.heap[0][1]) != self.heap[0][0]:
+                    heapq.heappop(self.heap)
+
+                self.wakeup.clear()
+                if not self.heap:
+                    await self.wakeup.wait()
+                    continue
+
+                renewAt, _ = self.heap[0]
+                delay = (renewAt - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self.renewBatch(self.takeBatch())
+            except Exception:
+                error(traceback.format_exc())
+
+    # takes everything that's due (up to batchSize), along with anything due within the jitter window so it goes out in the same batch
+    def takeBatch(self) -> list[str]:
+        cutoff = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.jitterSeconds)
+        batch = []
+        while self.heap and len(batch) < self.batchSize and self.heap[0][0] <= cutoff:
+            renewAt, ytChannelID = heapq.heappop(self.heap)
+            if self.renewals.get(ytChannelID) != renewAt:
+                continue
+            del self.renewals[ytChannelID]
+            batch.append(ytChannelID)
+        return batch
+
+    async def renewBatch(self, batch: list[str]):
+        debug(f'Renewing {len(batch)} youtube leases.')
+        self.renewing.update(batch)
+        try:
+            await asyncio.gather(*(self.renew(ytChannelID) for ytChannelID in batch))
+        finally:
+            self.renewing.difference_update(batch)
+        stats = self.stats()
+        info(f'Renewed a batch of {len(batch)} youtube leases, {stats["pending"]} leases scheduled, {stats["overdue"]} expired without being renewed, {stats["renewing"]} still renewing.')
+
+    async def renew(self, ytChannelID: str):
+        async with self.hubLimit:
+            ytChannel = await YoutubeChannel.get_or_none(id=ytChannelID)
+            status = await subscribeToYoutubeUploads(ytChannel) if ytChannel else None
+        if not ytChannel or not await YoutubeChannel.exists(id=ytChannelID):
+            # deleted while waiting, or had no announcements left and got deleted by the subscribe
+            self.cancel(ytChannelID)
+            return
+        if ytChannelID in self.renewals:
+            # the hub already verified the new lease and rescheduled it
+            return
+        if status != 202:
+            warn(f'Renewing youtube lease for {ytChannelID} failed with status {status}, trying again in {self.retrySeconds} seconds.')
+        # the hub verifies asynchronously and that reschedules the lease, this is only in case the verification never arrives
+        self.push(ytChannelID, datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.retrySeconds))
+
+leaseScheduler = LeaseScheduler(
+    getattr(sketchAuth, 'youtubeLeaseBatchSize', 50),
+    getattr(sketchAuth, 'youtubeLeaseConcurrency', 5),
+    getattr(sketchAuth, 'youtubeLeaseJitterSeconds', 600),
+    getattr(sketchAuth, 'youtubeLeaseRetrySeconds', 900)
+)
 
 # pubsub connection for notifications about uploads
 async def subscribeToYoutubeUploads(ytChannel: YoutubeChannel):
@@ -64,6 +172,7 @@ async def subscribeToYoutubeUploads(ytChannel: YoutubeChannel):
             # there are no yt announcements
             info(f'attempted subscription refresh for channel {ytChannel.id} with no associated announcements, so deleting')
             await ytChannel.delete()
+            leaseScheduler.cancel(ytChannel.id)
             return 500
         baseCallbackURL = sketchAuth.devPublicCallbackURL if sketchShared.dev else sketchAuth.baseCallbackURL
         callbackURL = f'{baseCallbackURL}youtube/{ytChannel.id}'
@@ -76,50 +185,107 @@ async def subscribeToYoutubeUploads(ytChannel: YoutubeChannel):
     
 
 
-# gets all youtube videos from a channel that have been uploaded
-# stores them in the database rn as a list in json format associated with a YoutubeChannel
+# gets all youtube videos from a channel that have been uploaded, so only videos uploaded after this get announced
+# the first page is requested right away so a bad channel id can be reported back, every page after that is collected by a background job
+# each page is written to the database as it arrives along with the next page token, so a backfill that gets interrupted carries on from where it was (see resumeYoutubeBackfills)
 async def gatherYoutubeVideos(ytChannel: YoutubeChannel):
-    info(f'Beginning requests to collect all youtube videos for {ytChannel.id}')
+    if ytChannel.id in backfillTasks:
+        debug(f'Already collecting youtube videos for {ytChannel.id}.')
+        return 200
 
-    videoList = []
+    info(f'Beginning requests to collect all youtube videos for {ytChannel.id}')
+    backfill, _ = await YoutubeBackfill.get_or_create(youtubeChannel=ytChannel)
+    status = await gatherYoutubeVideosPage(ytChannel, backfill)
+    if status == 200 and not backfill.complete:
+        startYoutubeBackfill(ytChannel, backfill)
+    return status
 
+# requests one page (max 50 videos) of the channel's upload playlist from where the backfill left off and stores it
+async def gatherYoutubeVideosPage(ytChannel: YoutubeChannel, backfill: YoutubeBackfill) -> int:
     # need user's "upload playlist" (search is limited to 500 videos and costs 100 query units vs 1 for list)
     # - the id of this playlist is the same as the channel's ID but the UC at the start is replaced with UU
     uploadPlaylist = ytChannel.id.replace('UC', 'UU', 1)
 
+    # call PlaylistItems with parts "snippet, contentDetails, status" to get all uploaded videos
     params = {'part': 'snippet, contentDetails, status', 'maxResults': 50, 'playlistId': uploadPlaylist, 'key': sketchAuth.ytAppToken}
+    if backfill.pageToken:
+        params['pageToken'] = backfill.pageToken
 
-    # call PlaylistItems with parts "snippet, contentDetails, status" to get all uploaded videos
-    # - use pagination to get info for all videos (max 50 per page)
-    while True:
-        async with sketchServer.clientSession.get('https://www.googleapis.com/youtube/v3/playlistItems', params=params) as resp:
-            if resp.status != 200:
-                return resp.status
-            else:
-                data = await resp.json()
-                nextPage = data.get('nextPageToken')
-                items = data.get('items')
-
-                debug('Got response with next page: ' + str(nextPage))
-
-                if items:
-                    for video in data['items']:
-                        videoList.append(video['contentDetails']['videoId'])
-                else:
-                    return resp.status
-                
-                if nextPage:
-                    params['pageToken'] = nextPage
-                else:
-                    break
-    
-    # insert all collected videos into database so only new ones are announced from here
-    ytChannel.announcedVideos = videoList
-    await ytChannel.save(update_fields=['announcedVideos'])
-    info(f'Finished requests for {ytChannel.id} videos. Inserted {len(videoList)} videos into database.')
-    debug(str(videoList))
+    async with sketchServer.clientSession.get('https://www.googleapis.com/youtube/v3/playlistItems', params=params) as resp:
+        if resp.status != 200:
+            return resp.status
+        data = await resp.json()
+
+    nextPage = data.get('nextPageToken')
+    items = data.get('items') or []
+    debug('Got response with next page: ' + str(nextPage))
+
+    # insert the page and move the checkpoint together, so a crash can never skip a page
+    async with in_transaction():
+        await YoutubeVideo.bulk_create([createYoutubeVideo(ytChannel, video) for video in items], ignore_conflicts=True)
+        backfill.pageToken = nextPage
+        backfill.videosGathered += len(items)
+        backfill.complete = not nextPage
+        backfill.error = None
+        await backfill.save()
+
+    if backfill.complete:
+        info(f'Finished requests for {ytChannel.id} videos. Inserted {backfill.videosGathered} videos into database.')
+        backfillProgress.pop(ytChannel.id, None)
+    else:
+        backfillProgress[ytChannel.id] = backfill
     return resp.status
 
+def startYoutubeBackfill(ytChannel: YoutubeChannel, backfill: YoutubeBackfill):
+    backfillProgress[ytChannel.id] = backfill
+    task = asyncio.get_running_loop().create_task(runYoutubeBackfill(ytChannel, backfill))
+    backfillTasks[ytChannel.id] = task
+    task.add_done_callback(lambda _: backfillTasks.pop(ytChannel.id, None))
+
+# keeps requesting pages until the whole upload playlist is stored, retrying with a backoff when youtube has problems
+async def runYoutubeBackfill(ytChannel: YoutubeChannel, backfill: YoutubeBackfill):
+    failures = 0
+    try:
+        while not backfill.complete:
+            status = await gatherYoutubeVideosPage(ytChannel, backfill)
+            if status == 200:
+                failures = 0
+                continue
+            failures += 1
+            if failures >= backfillMaxFailures:
+                # leave the checkpoint where it is, it'll be tried again next time sketch starts
+                backfill.error = f'Error {status} from YouTube'
+                await backfill.save(update_fields=['error'])
+                error(f'Giving up collecting youtube videos for {ytChannel.id} after {failures} errors (last was {status}).')
+                return
+            await asyncio.sleep(2 ** failures)
+    except Exception:
+        backfill.error = 'Unexpected error'
+        # log the original error first, so a database problem while saving can't hide it
+        error(f'Error collecting youtube videos for {ytChannel.id}: ' + traceback.format_exc())
+        try:
+            await backfill.save(update_fields=['error'])
+        except Exception:
+            error(f'Could not save backfill error for {ytChannel.id}: ' + traceback.format_exc())
+
+# carries on with any backfills that didn't finish before sketch stopped
+async def resumeYoutubeBackfills():
+    for backfill in await YoutubeBackfill.filter(complete=False).select_related('youtubeChannel'):
+        if backfill.youtubeChannel.id not in backfillTasks:
+            info(f'Resuming collection of youtube videos for {backfill.youtubeChannel.id} ({backfill.videosGathered} so far).')
+            startYoutubeBackfill(backfill.youtubeChannel, backfill)
+
+# makes an unsaved YoutubeVideo from a playlistItems item
+def createYoutubeVideo(ytChannel: YoutubeChannel, video: dict) -> YoutubeVideo:
+    snippet = video.get('snippet') or {}
+    published = video['contentDetails'].get('videoPublishedAt')
+    return YoutubeVideo(
+        youtubeChannel=ytChannel,
+        videoID=video['contentDetails']['videoId'],
+        title=snippet.get('title'),
+        published=dateutil.parser.isoparse(published) if published else None
+    )
+
 # This is used when getting info from YT for displaying videos on the site, scheduling etc.
 # To use this, I will need to change the JSONField to store dicts, or create a model for individual videos that store their id, titles, privacy status, etc. and create a one-to-many relation from the channel to the many videos
 # creates / updates dictionary with video data from a list returned by youtube
@@ -0,0 +1,32 @@
+import asyncio, logging
+import sketchDiscord
+
+async def sendAll(dispatcher: sketchDiscord.AnnouncementDispatcher, channels: list[int], sent: list, failChannel: int = None) -> list:
+    def makeSend(channelID: int, index: int):
+        async def send():
+            await asyncio.sleep(0.001)
+            if channelID == failChannel:
+                raise RuntimeError('discord said no')
+            sent.append((channelID, index))
+        return send
+    return await dispatcher.submitAll([(channelID, makeSend(channelID, index)) for index, channelID in enumerate(channels)])
+
+def test_submit_all_sends_in_order_per_channel():
+    dispatcher = sketchDiscord.AnnouncementDispatcher(2)
+    sent = []
+    failed = asyncio.run(sendAll(dispatcher, [1, 2, 1, 3, 1], sent))
+    assert failed == []
+    assert [index for channelID, index in sent if channelID == 1] == [0, 2, 4]
+    assert sorted(sent) == [(1, 0), (1, 2), (1, 4), (2, 1), (3, 3)]
+    # locks for channels nobody is waiting on get thrown away
+    assert dispatcher.channelLocks == {} and dispatcher.channelWaiting == {}
+
+def test_submit_all_returns_failures_and_logs_summary(caplog):
+    dispatcher = sketchDiscord.AnnouncementDispatcher(2)
+    sent = []
+    with caplog.at_level(logging.INFO):
+        failed = asyncio.run(sendAll(dispatcher, [1, 2, 3], sent, failChannel=2))
+    assert [channelID for channelID, _ in failed] == [2]
+    assert sorted(sent) == [(1, 0), (3, 2)]
+    assert dispatcher.stats()['sends'] == 3
+    assert any(record.getMessage().startswith('Sent 2 of 3 announcements. Over the last 3 sends') for record in caplog.records)
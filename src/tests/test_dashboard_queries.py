@@ -0,0 +1,79 @@
+import asyncio, logging
+from tortoise import Tortoise
+from sketchModels import *
+import sketchServer
+
+# counts the sql statements tortoise runs, it logs each one to tortoise.db_client at debug level
+class QueryCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.queries += 1
+
+async def createGuilds(user: DiscordUser, count: int, firstID: int):
+    for guildID in range(firstID, firstID + count):
+        # half owned by the user, half that they're only authorized for
+        owned = guildID % 2 == 0
+        guild = await DiscordGuild.create(id=guildID, name=f'guild {guildID}', owner=user.id if owned else 1)
+        if not owned:
+            await guild.authorizedUsers.add(user)
+        await DiscordJoinRole.create(id=guildID * 10, name='join role', guild=guild)
+        await TwitchAnnouncement.create(streamName='stream', announcementText='live!', guild=guild, channelID=guildID * 100)
+        youtubeChannel, _ = await YoutubeChannel.get_or_create(id=f'UC{guildID}')
+        await YoutubeAnnouncement.create(channelID=guildID * 100, announcementText='new video!', youtubeChannel=youtubeChannel, guild=guild)
+
+# the queries the /discord handler made before loadDashboardGuilds, kept here to compare against
+async def loadDashboardGuildsBefore(user: DiscordUser) -> list[DiscordGuild]:
+    guilds = []
+    for guild in await DiscordGuild.filter(owner=user.id):
+        await guild.fetch_related('twitchAnnouncements')
+        await guild.fetch_related('authorizedUsers')
+        await guild.fetch_related('joinRoles')
+        guilds.append(guild)
+    for guild in await user.authorizedGuilds.all():
+        await guild.fetch_related('twitchAnnouncements')
+        await guild.fetch_related('authorizedUsers')
+        await guild.fetch_related('joinRoles')
+        guilds.append(guild)
+    return guilds
+
+async def countDashboardQueries(guildCount: int, loader=sketchServer.loadDashboardGuilds) -> tuple[int, list]:
+    await Tortoise.init(db_url='sqlite://:memory:', modules={'models': ['sketchModels']})
+    try:
+        await Tortoise.generate_schemas()
+        user = await DiscordUser.create(id=1000, name='user', username='user')
+        await createGuilds(user, guildCount, 1)
+
+        counter = QueryCounter()
+        dbLogger = logging.getLogger('tortoise.db_client')
+        previousLevel = dbLogger.level
+        dbLogger.setLevel(logging.DEBUG)
+        dbLogger.addHandler(counter)
+        try:
+            guilds = await loader(user)
+        finally:
+            dbLogger.removeHandler(counter)
+            dbLogger.setLevel(previousLevel)
+        return counter.queries, guilds
+    finally:
+        await Tortoise.close_connections()
+
+def test_dashboard_loads_everything():
+    _, guilds = asyncio.run(countDashboardQueries(4))
+    assert sorted(guild['id'] for guild in guilds) == [1, 2, 3, 4]
+    for guild in guilds:
+        assert guild['joinRoles'] == [{'id': guild['id'] * 10, 'name': 'join role'}]
+        assert [announcement['channelID'] for announcement in guild['twitchAnnouncements']] == [guild['id'] * 100]
+        assert [announcement['youtubeChannelID'] for announcement in guild['youtubeAnnouncements']] == [f'UC{guild["id"]}']
+        assert [authorizedUser['id'] for authorizedUser in guild['authorizedUsers']] == ([] if guild['id'] % 2 == 0 else [1000])
+
+# the number of queries per render mustn't grow with the number of guilds
+def test_dashboard_query_count_is_fixed():
+    fewQueries, _ = asyncio.run(countDashboardQueries(2))
+    manyQueries, _ = asyncio.run(countDashboardQueries(50))
+    fewQueriesBefore, _ = asyncio.run(countDashboardQueries(2, loadDashboardGuildsBefore))
+    manyQueriesBefore, _ = asyncio.run(countDashboardQueries(50, loadDashboardGuildsBefore))
+    print(f'dashboard render: {fewQueries} queries for 2 guilds and {manyQueries} for 50, before it was {fewQueriesBefore} and {manyQueriesBefore} (without youtube announcements)')
+    assert fewQueries == manyQueries
@@ -0,0 +1,165 @@
+import logging, traceback, inspect, time, sys
+import sketchShared
+
+fileFormat = '%(asctime)s %(levelname)-8s %(name)s - %(module)s: %(message)s'
+consoleFormat = '%(levelname)-8s %(name)s - %(module)s: %(message)s'
+
+def makeRecord(name: str, level: int, path: str, message: str, **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, path, 1, message, None, None)
+    # the same time for every copy of a record, so formatters can be compared
+    record.created = 1700000000.0
+    record.msecs = 0.0
+    record.__dict__.update(extra)
+    return record
+
+# (name, level, path, message) for the kinds of records sketch logs
+records = [
+    ('root', logging.INFO, '/sketch/sketchDiscord.py', 'Connected as sketch'),
+    ('discord.gateway', logging.WARNING, '/usr/lib/discord/gateway.py', 'Shard ID None heartbeat blocked'),
+    ('root', logging.ERROR, '/sketch/sketchTwitch.py', 'Failed announcing:\nTraceback (most recent call last):\n  File "x.py", line 1'),
+    ('stdout', logging.INFO, '/sketch/sketchShared.py', 'YOUTUBE: printed something'),
+    ('stderr', logging.ERROR, '/sketch/sketchShared.py', 'SERVER: first line\nsecond line'),
+    ('root', logging.DEBUG, '/sketch/sketch.py', 'Summoning...')
+]
+
+def test_format_single_and_multiple_lines():
+    formatter = sketchShared.SketchLogFormatter(consoleFormat)
+    assert formatter.format(makeRecord(*records[0])) == 'INFO     root - DISCORD: Connected as sketch'
+    assert formatter.format(makeRecord(*records[1])) == 'WARNING  discord - GATEWAY: Shard ID None heartbeat blocked'
+    assert formatter.format(makeRecord(*records[5])) == 'DEBUG    root - SKETCH: Summoning...'
+    assert formatter.format(makeRecord(*records[2])).splitlines() == [
+        'ERROR    root - TWITCH: Failed announcing:',
+        'ERROR    root - TWITCH: Traceback (most recent call last):',
+        'ERROR    root - TWITCH:   File "x.py", line 1'
+    ]
+
+def test_format_stdout_and_stderr():
+    formatter = sketchShared.SketchLogFormatter(consoleFormat)
+    assert formatter.format(makeRecord(*records[3])) == 'STDOUT   stdout - YOUTUBE: printed something'
+    assert formatter.format(makeRecord(*records[4])).splitlines() == [
+        'STDERR   stderr - SERVER: first line',
+        'STDERR   stderr - SERVER: second line'
+    ]
+    # the stdout format mustn't leak into the next record
+    assert formatter.format(makeRecord(*records[0])) == 'INFO     root - DISCORD: Connected as sketch'
+
+def test_format_uncaught_exception_module():
+    formatter = sketchShared.SketchLogFormatter(consoleFormat)
+    uncaught = makeRecord('root', logging.CRITICAL, '/sketch/sketchShared.py', 'FATAL UNCAUGHT EXCEPTION:', uncaughtModule='sketchYoutube')
+    assert formatter.format(uncaught) == 'CRITICAL root - YOUTUBE: FATAL UNCAUGHT EXCEPTION:'
+    # only the uncaught exception's own record gets the raising module
+    assert formatter.format(makeRecord(*records[0])) == 'INFO     root - DISCORD: Connected as sketch'
+
+def test_handlers_dont_change_the_record():
+    # the file and console handlers format the same record one after the other
+    fileFormatter = sketchShared.SketchLogFormatter(fileFormat)
+    consoleFormatter = sketchShared.SketchLogFormatter(consoleFormat)
+    record = makeRecord(*records[1])
+    consoleFormatter.format(record)
+    assert fileFormatter.format(record).endswith('WARNING  discord - GATEWAY: Shard ID None heartbeat blocked')
+    assert record.name == 'discord.gateway' and record.module == 'gateway' and record.levelname == 'WARNING'
+
+# the formatter from before it was reworked, kept here to compare against
+# uncaughtTraceback stands in for the global it used to read, which stayed set for the rest of the run once anything went uncaught
+uncaughtTraceback = None
+
+class SketchLogFormatterBefore(logging.Formatter):
+    def format(self, record):
+        if uncaughtTraceback:
+            modulePath = traceback.extract_tb(uncaughtTraceback)[-1].filename
+            moduleName = inspect.getmodulename(modulePath)
+            if moduleName:
+                record.module = moduleName
+
+        record.module = record.module.upper()
+        if record.module != 'SKETCH' and record.module.startswith('SKETCH'):
+            record.module = record.module.removeprefix('SKETCH')
+
+        if record.module == 'SHARED' and (record.name == 'stdout' or record.name == 'stderr'):
+            record.levelname = record.name.upper()
+            self._fmt = self._fmt.replace('%(module)s: ', '')
+            self._style._fmt = self._style._fmt.replace('%(module)s: ', '')
+        else:
+            if '%(module)s' not in self._fmt:
+                self._fmt = self._fmt.replace('%(message)s', '%(module)s: %(message)s')
+                self._style._fmt = self._style._fmt.replace('%(message)s', '%(module)s: %(message)s')
+
+        record.name = record.name.split('.', 1)[0]
+        orig = logging.Formatter.format(self, record)
+
+        splitOrig = orig.split('\n')
+        origPrefix = orig.partition(record.message)[0]
+        if '%(module)s' not in self._fmt:
+            partMessage = record.message.partition(': ')
+            origPrefix = '\n' + origPrefix + partMessage[0] + partMessage[1]
+        else:
+            origPrefix = '\n' + origPrefix
+        if len(splitOrig) > 1:
+            orig = origPrefix.join(splitOrig)
+        return orig
+
+    def formatTime(self, record, datefmt=None):
+        return sketchShared.SketchLogFormatter.formatTime(self, record, datefmt)
+
+def test_format_matches_previous_formatter():
+    formatter = sketchShared.SketchLogFormatter(fileFormat)
+    formatterBefore = SketchLogFormatterBefore(fileFormat)
+    for record in records:
+        assert formatter.format(makeRecord(*record)) == formatterBefore.format(makeRecord(*record))
+
+def getTraceback():
+    try:
+        raise ValueError('uncaught')
+    except ValueError:
+        return sys.exc_info()[2]
+
+def timeFormatter(formatter: logging.Formatter, runs: int) -> float:
+    # records are made up front, so only the formatting is timed
+    batch = [makeRecord(*records[index % len(records)]) for index in range(runs)]
+    start = time.perf_counter()
+    for record in batch:
+        formatter.format(record)
+    return runs / (time.perf_counter() - start)
+
+# run with -s to see the numbers, nothing is asserted since they depend on the machine
+def test_benchmark_against_previous_formatter():
+    global uncaughtTraceback
+    runs = 20000
+    after = timeFormatter(sketchShared.SketchLogFormatter(fileFormat), runs)
+    before = timeFormatter(SketchLogFormatterBefore(fileFormat), runs)
+    uncaughtTraceback = getTraceback()
+    try:
+        beforeUncaught = timeFormatter(SketchLogFormatterBefore(fileFormat), runs)
+    finally:
+        uncaughtTraceback = None
+    print(f'log formatting: {after:,.0f} records/s, before {before:,.0f} records/s ({beforeUncaught:,.0f} records/s once an exception had gone uncaught)')
+
+class CountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+def test_stdout_writer():
+    handler = CountingHandler()
+    logger = logging.getLogger('stdout-test')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        writer = sketchShared.LoggerWriter('stdout-test', logging.INFO)
+        # print() writes the text and the newline separately
+        writer.write('hello ')
+        writer.write('there')
+        writer.write('\n')
+        writer.write(b'bytes\n')
+        assert handler.messages == ['TEST_LOG_FORMATTER: hello there', 'TEST_LOG_FORMATTER: bytes']
+
+        runs = 20000
+        start = time.perf_counter()
+        for _ in range(runs):
+            writer.write('a line\n')
+        print(f'stdout redirection: {runs / (time.perf_counter() - start):,.0f} lines/s')
+    finally:
+        logger.removeHandler(handler)
@@ -0,0 +1,130 @@
+import asyncio, logging, logging.handlers, queue, threading, time
+import sketchShared
+
+class CountingHandler(logging.Handler):
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        # stands in for a disk or console that's slow to write to
+        self.delay = delay
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        if self.delay:
+            time.sleep(self.delay)
+        self.messages.append(record.getMessage())
+
+def makeLogger(name: str, *handlers: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = list(handlers)
+    return logger
+
+def makeRecord(level: int, message: str) -> logging.LogRecord:
+    return logging.LogRecord('queue-test', level, __file__, 1, message, None, None)
+
+def test_full_queue_drops_below_warning():
+    logQueue = queue.Queue(5)
+    handler = sketchShared.SketchQueueHandler(logQueue)
+    for index in range(5):
+        handler.handle(makeRecord(logging.DEBUG, f'debug {index}'))
+    handler.handle(makeRecord(logging.DEBUG, 'dropped debug'))
+    handler.handle(makeRecord(logging.INFO, 'dropped info'))
+    assert handler.dropped == 2
+    assert logQueue.qsize() == 5
+
+    # a warning waits for room instead of being dropped, then says how many were dropped
+    warning = threading.Thread(target=handler.handle, args=(makeRecord(logging.WARNING, 'kept warning'),))
+    warning.start()
+    time.sleep(0.1)
+    assert warning.is_alive()
+
+    messages = []
+    while warning.is_alive() or not logQueue.empty():
+        try:
+            messages.append(logQueue.get(timeout=0.1).getMessage())
+        except queue.Empty:
+            pass
+    warning.join()
+    assert messages == [f'debug {index}' for index in range(5)] + ['kept warning', 'Dropped 2 log messages because the log queue was full.']
+    assert handler.dropped == 0
+
+def test_full_queue_keeps_everything_without_dropping():
+    logQueue = queue.Queue(2)
+    handler = sketchShared.SketchQueueHandler(logQueue, dropWhenFull=False)
+    handler.handle(makeRecord(logging.DEBUG, 'first'))
+    handler.handle(makeRecord(logging.DEBUG, 'second'))
+    blocked = threading.Thread(target=handler.handle, args=(makeRecord(logging.DEBUG, 'third'),))
+    blocked.start()
+    time.sleep(0.1)
+    assert blocked.is_alive()
+    assert logQueue.get().getMessage() == 'first'
+    blocked.join()
+    assert [logQueue.get().getMessage() for _ in range(2)] == ['second', 'third']
+
+def test_stop_logging_flushes_queue(monkeypatch):
+    # stopLogging works on sketchShared's globals, so it gets its own logger, queue and handlers to stop
+    fileHandler = CountingHandler(delay=0.0005)
+    consoleHandler = CountingHandler()
+    logQueue = queue.Queue(1000)
+    queueHandler = sketchShared.SketchQueueHandler(logQueue)
+    queueListener = logging.handlers.QueueListener(logQueue, fileHandler, respect_handler_level=True)
+    logger = makeLogger('stop-test', queueHandler)
+    monkeypatch.setattr(sketchShared, 'rootLogger', logger)
+    monkeypatch.setattr(sketchShared, 'rootHandler', fileHandler)
+    monkeypatch.setattr(sketchShared, 'console', consoleHandler)
+    monkeypatch.setattr(sketchShared, 'queueHandler', queueHandler)
+    monkeypatch.setattr(sketchShared, 'queueListener', queueListener)
+    queueListener.start()
+
+    for index in range(200):
+        logger.info(f'queued {index}')
+    sketchShared.stopLogging()
+    assert fileHandler.messages == [f'queued {index}' for index in range(200)]
+    assert logger.handlers == [fileHandler, consoleHandler]
+
+    # anything logged afterwards goes straight to the handlers, and stopping again changes nothing
+    logger.info('after stopping')
+    sketchShared.stopLogging()
+    assert fileHandler.messages[-1] == 'after stopping' and consoleHandler.messages == ['after stopping']
+    assert logger.handlers == [fileHandler, consoleHandler]
+
+async def burstWithProbe(logger: logging.Logger, records: int) -> float:
+    # how late a 1ms sleep wakes up while a coroutine logs in a burst, the longest the loop was stuck
+    lag = 0.0
+    stop = False
+    async def probe():
+        nonlocal lag
+        while not stop:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+    probeTask = asyncio.create_task(probe())
+    await asyncio.sleep(0.01)
+    for index in range(records):
+        logger.info(f'burst {index}')
+        # yields every so often, like a command that logs a few lines per step
+        if index % 50 == 0:
+            await asyncio.sleep(0)
+    stop = True
+    await probeTask
+    return lag
+
+# run with -s to see the numbers, only that every record gets written is checked since timings depend on the machine
+def test_benchmark_loop_lag_direct_and_queued():
+    records = 500
+
+    directHandler = CountingHandler(delay=0.0005)
+    directLag = asyncio.run(burstWithProbe(makeLogger('lag-direct', directHandler), records))
+
+    queuedHandler = CountingHandler(delay=0.0005)
+    logQueue = queue.Queue(sketchShared.logQueueSize)
+    listener = logging.handlers.QueueListener(logQueue, queuedHandler, respect_handler_level=True)
+    listener.start()
+    try:
+        queuedLag = asyncio.run(burstWithProbe(makeLogger('lag-queued', sketchShared.SketchQueueHandler(logQueue)), records))
+    finally:
+        listener.stop()
+
+    assert len(directHandler.messages) == len(queuedHandler.messages) == records
+    print(f'loop lag logging {records} records to a 0.5ms handler: {directLag * 1000:.1f}ms with the handler on the loop, {queuedLag * 1000:.1f}ms through the queue')
@@ -0,0 +1,41 @@
+import os
+import sketchServer
+
+def append(path: str, text: bytes):
+    with open(path, 'ab') as f:
+        f.write(text)
+
+def test_tail_reads_new_lines(tmp_path):
+    path = str(tmp_path / 'sketch.log')
+    append(path, b'old line\n')
+    position, inode = sketchServer.getLogFileEnd(path)
+    assert sketchServer.readLogFrom(path, position, inode) == (b'', position, inode)
+
+    append(path, b'new line\npartial')
+    data, position, inode = sketchServer.readLogFrom(path, position, inode)
+    assert data == b'new line\npartial'
+    assert position == os.path.getsize(path)
+
+def test_tail_finishes_rotated_file_first(tmp_path):
+    path = str(tmp_path / 'sketch.log')
+    append(path, b'first\n')
+    position, inode = sketchServer.getLogFileEnd(path)
+    # written just before the rotation, after the last read
+    append(path, b'before rotation\n')
+    os.rename(path, path + '.1')
+    append(path, b'after rotation\n')
+
+    data, position, newInode = sketchServer.readLogFrom(path, position, inode)
+    assert data == b'before rotation\nafter rotation\n'
+    assert newInode != inode and position == len(b'after rotation\n')
+
+    append(path, b'later\n')
+    assert sketchServer.readLogFrom(path, position, newInode) == (b'later\n', position + len(b'later\n'), newInode)
+
+def test_tail_restarts_truncated_file(tmp_path):
+    path = str(tmp_path / 'sketch.log')
+    append(path, b'a long line that gets truncated\n')
+    position, inode = sketchServer.getLogFileEnd(path)
+    with open(path, 'wb') as f:
+        f.write(b'short\n')
+    assert sketchServer.readLogFrom(path, position, inode) == (b'short\n', len(b'short\n'), inode)
@@ -0,0 +1,127 @@
+import asyncio, time, types
+import discord
+import pytest
+import sketchDiscord
+
+guildID = 100
+messageID = 200
+channelID = 300
+
+# a role message with a row of five buttons, the way /rolemessage makes them
+roleIDs = [1000 + index for index in range(5)]
+emojis = ['🍎', '🍊', '🍋', '🍏', '🫐']
+def makeComponents() -> list:
+    buttons = [{'type': 2, 'style': 1, 'custom_id': f'r:{index}:{roleID}', 'label': f'role {index}', 'emoji': {'name': emojis[index]}} for index, roleID in enumerate(roleIDs)]
+    return [discord.components.ActionRow({'type': 1, 'components': buttons})]
+
+# only the parts of an interaction the role button path reads
+def makeInteraction(pressed: list, customID: str, roles: dict) -> types.SimpleNamespace:
+    async def defer(**kwargs):
+        pressed.append(('defer', time.perf_counter()))
+    guild = types.SimpleNamespace(id=guildID, get_role=roles.get, icon=None)
+    return types.SimpleNamespace(
+        type=discord.InteractionType.component,
+        data={'component_type': discord.ComponentType.button.value, 'custom_id': customID},
+        command=None,
+        user=types.SimpleNamespace(id=1, name='user', roles=[]),
+        guild=guild,
+        guild_id=guildID,
+        message=types.SimpleNamespace(id=messageID, components=makeComponents(), embeds=[], channel=types.SimpleNamespace(id=channelID), guild=guild),
+        response=types.SimpleNamespace(defer=defer)
+    )
+
+@pytest.fixture
+def rolePresses(monkeypatch):
+    # records what a press got as far as instead of changing any roles, and gives the bot the registry setup_hook would have loaded
+    pressed = []
+    def submit(interaction, role, emoji=None):
+        pressed.append(('submit', time.perf_counter(), role, emoji))
+    errors = []
+    async def on_app_command_error(interaction, err):
+        errors.append(err)
+    monkeypatch.setattr(sketchDiscord, 'roleMutationScheduler', types.SimpleNamespace(submit=submit))
+    monkeypatch.setattr(sketchDiscord, 'on_app_command_error', on_app_command_error)
+    monkeypatch.setattr(sketchDiscord.bot, 'roleMessages', {}, raising=False)
+    monkeypatch.setattr(sketchDiscord.bot, 'channelRoleMessages', {}, raising=False)
+    roles = {roleID: types.SimpleNamespace(id=roleID, name=f'role {roleID}') for roleID in roleIDs}
+    sketchDiscord.cacheRoleMessage(sketchDiscord.roleMessageRecordFromMessage(makeInteraction([], 'r:0:0', roles).message))
+    return pressed, errors, roles
+
+def test_press_submits_role_and_emoji(rolePresses):
+    pressed, errors, roles = rolePresses
+    asyncio.run(sketchDiscord.on_interaction(makeInteraction(pressed, f'r:2:{roleIDs[2]}', roles)))
+    assert [step[0] for step in pressed] == ['defer', 'submit']
+    assert pressed[1][2] is roles[roleIDs[2]] and pressed[1][3] == emojis[2]
+    assert errors == []
+
+def test_press_for_deleted_role_is_reported(rolePresses):
+    pressed, errors, roles = rolePresses
+    del roles[roleIDs[4]]
+    asyncio.run(sketchDiscord.on_interaction(makeInteraction(pressed, f'r:4:{roleIDs[4]}', roles)))
+    assert [step[0] for step in pressed] == ['defer']
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+# on_interaction from before role buttons used the registry, kept here to compare against
+# it ran up to the role change, then rebuilt the view from the message to find the button's emoji for the reply
+async def rolePressBefore(interaction, submit):
+    sketchDiscord.info((('Command "' + str(interaction.command.name)) if interaction.command else ('Component "' + str(interaction.data))) + '" invoked by ' + str(interaction.user.name) + ' ('+ str(interaction.user.id) +') on server "' + str(interaction.guild) + '".')
+    sketchDiscord.debug(str(interaction.type))
+    ctype = discord.enums.try_enum(discord.ComponentType, interaction.data["component_type"])
+    sketchDiscord.debug('component type interacted with: ' + str(ctype))
+    sketchDiscord.debug('component is button!')
+    customId: str = interaction.data["custom_id"]
+    await interaction.response.defer()
+
+    # split 0 = r, split 1 = numDuplicate, split 2 = roleId
+    customId = customId.split(':')[2]
+    sketchDiscord.debug('ROLE BUTTON PRESSED, ROLE ID: ' + customId)
+    newRoleId = int(customId)
+
+    if interaction.message.id not in sketchDiscord.bot.roleMessages:
+        raise AssertionError('the role message is always saved here')
+
+    newRole = interaction.guild.get_role(newRoleId)
+    if not newRole:
+        raise AssertionError('the role is always cached here')
+
+    roleView = discord.ui.View.from_message(interaction.message)
+    buttonEmoji = None
+    for child in roleView.children:
+        if child.custom_id == interaction.data["custom_id"]:
+            buttonEmoji = child.emoji
+    submit(interaction, newRole, str(buttonEmoji))
+
+async def timePresses(press, pressed: list, roles: dict, runs: int) -> tuple[float, float]:
+    # (press to defer, press to submit) in seconds, averaged over the runs
+    toDefer = toSubmit = 0.0
+    for run in range(runs):
+        index = run % len(roleIDs)
+        interaction = makeInteraction(pressed, f'r:{index}:{roleIDs[index]}', roles)
+        pressed.clear()
+        start = time.perf_counter()
+        await press(interaction)
+        toDefer += pressed[0][1] - start
+        toSubmit += pressed[1][1] - start
+    return toDefer / runs, toSubmit / runs
+
+# run with -s to see the numbers, only the results are checked since timings depend on the machine
+def test_benchmark_against_previous_press(rolePresses):
+    pressed, errors, roles = rolePresses
+    submit = sketchDiscord.roleMutationScheduler.submit
+    async def pressBefore(interaction):
+        await rolePressBefore(interaction, submit)
+
+    async def compare():
+        for index, roleID in enumerate(roleIDs):
+            await pressBefore(makeInteraction(pressed, f'r:{index}:{roleID}', roles))
+            before = pressed[-1]
+            await sketchDiscord.on_interaction(makeInteraction(pressed, f'r:{index}:{roleID}', roles))
+            after = pressed[-1]
+            assert (after[2], after[3]) == (before[2], before[3])
+
+        runs = 2000
+        beforeTimes = await timePresses(pressBefore, pressed, roles, runs)
+        afterTimes = await timePresses(sketchDiscord.on_interaction, pressed, roles, runs)
+        print(f'role button press: before {beforeTimes[0] * 1e6:.1f}us to defer and {beforeTimes[1] * 1e6:.1f}us to the role change, after {afterTimes[0] * 1e6:.1f}us and {afterTimes[1] * 1e6:.1f}us (without any REST calls)')
+    asyncio.run(compare())
+    assert errors == []
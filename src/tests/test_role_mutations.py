@@ -0,0 +1,58 @@
+import asyncio, types
+import sketchDiscord
+
+# a member whose role changes are recorded instead of sent to discord
+def makeMember(calls: list, roles: list) -> types.SimpleNamespace:
+    async def add_roles(role, reason=None):
+        calls.append(('add', role.id))
+    async def remove_roles(role, reason=None):
+        calls.append(('remove', role.id))
+    return types.SimpleNamespace(id=1, roles=roles, add_roles=add_roles, remove_roles=remove_roles)
+
+def makeInteraction(member: types.SimpleNamespace, name: str) -> types.SimpleNamespace:
+    return types.SimpleNamespace(user=member, guild_id=100, name=name)
+
+def makeScheduler() -> tuple[sketchDiscord.RoleMutationScheduler, list]:
+    scheduler = sketchDiscord.RoleMutationScheduler()
+    replies = []
+    async def reply(interaction, role, emoji, added):
+        replies.append((interaction.name, added))
+    scheduler.reply = reply
+    return scheduler, replies
+
+async def press(scheduler: sketchDiscord.RoleMutationScheduler, *interactions, role):
+    # all the presses land before the scheduler gets to run, like a quick double click
+    for interaction in interactions:
+        scheduler.submit(interaction, role, '🍎')
+    while scheduler.workers or scheduler.replies:
+        await asyncio.sleep(0)
+
+def test_single_press_adds_role():
+    scheduler, replies = makeScheduler()
+    calls = []
+    role = types.SimpleNamespace(id=1000)
+    member = makeMember(calls, [])
+    asyncio.run(press(scheduler, makeInteraction(member, 'first'), role=role))
+    assert calls == [('add', 1000)]
+    assert replies == [('first', True)]
+    assert scheduler.stats() == {'pressed': 1, 'coalesced': 0, 'applied': 1, 'skipped': 0, 'failed': 0, 'waiting': 0, 'running': 0}
+
+def test_presses_that_cancel_out_get_no_change_reply():
+    scheduler, replies = makeScheduler()
+    calls = []
+    role = types.SimpleNamespace(id=1000)
+    member = makeMember(calls, [role])
+    asyncio.run(press(scheduler, makeInteraction(member, 'first'), makeInteraction(member, 'second'), role=role))
+    assert calls == []
+    # only the last press hears back, and it's told nothing changed
+    assert replies == [('second', None)]
+    assert scheduler.stats()['skipped'] == 1 and scheduler.stats()['coalesced'] == 1
+
+def test_odd_presses_apply_once():
+    scheduler, replies = makeScheduler()
+    calls = []
+    role = types.SimpleNamespace(id=1000)
+    member = makeMember(calls, [role])
+    asyncio.run(press(scheduler, *(makeInteraction(member, name) for name in ('first', 'second', 'third')), role=role))
+    assert calls == [('remove', 1000)]
+    assert replies == [('third', False)]
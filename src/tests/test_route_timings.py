@@ -0,0 +1,26 @@
+import asyncio
+import aiohttp.web, aiohttp.test_utils
+import sketchServer
+
+async def requestTimedRoute(monkeypatch, requests: int) -> dict:
+    monkeypatch.setattr(sketchServer, 'routeTimings', {})
+    async def slowHandler(request: aiohttp.web.Request):
+        await asyncio.sleep(0.01)
+        return aiohttp.web.Response(text='ok')
+    app = aiohttp.web.Application(middlewares=[sketchServer.requestLoggingMiddleware, sketchServer.handlerTimingMiddleware])
+    app.router.add_get('/slow/{name}', slowHandler)
+    async with aiohttp.test_utils.TestClient(aiohttp.test_utils.TestServer(app)) as client:
+        for index in range(requests):
+            response = await client.get(f'/slow/{index}')
+            assert response.status == 200
+        assert (await client.get('/missing')).status == 404
+    return sketchServer.routeTimingStats()
+
+def test_route_timing_stats(monkeypatch):
+    stats = asyncio.run(requestTimedRoute(monkeypatch, 3))
+    # requests are grouped by route, not by path
+    assert stats.keys() == {'/slow/{name}', 'unmatched'}
+    slow = stats['/slow/{name}']
+    assert slow['requests'] == 3
+    assert slow['handler'] >= 0.01
+    assert slow['queue'] >= 0 and slow['template'] >= 0
@@ -0,0 +1,105 @@
+import asyncio, datetime, hashlib, hmac, json, uuid
+import aiohttp.web, aiohttp.test_utils
+import pytest
+import sketchTwitch, sketchServer
+
+testSecret = 'a test eventsub secret'
+
+@pytest.fixture(autouse=True)
+def eventSub(monkeypatch):
+    # turns eventsub on with the test secret, and records notifications instead of announcing them
+    started = []
+    async def handleEventSubNotification(subscriptionType: str, streamID: str):
+        started.append((subscriptionType, streamID))
+    monkeypatch.setattr(sketchTwitch, 'eventSubSecret', testSecret)
+    monkeypatch.setattr(sketchTwitch, 'handleEventSubNotification', handleEventSubNotification)
+    sketchTwitch.eventSubRecentMessages.clear()
+    return started
+
+# what a local fake of twitch sends: the message headers, signed with the secret, and the json body
+def fakeEventSubMessage(messageType: str, payload: dict, messageID: str = None, timestamp: str = None, secret: str = testSecret) -> tuple[dict, bytes]:
+    messageID = messageID or str(uuid.uuid4())
+    timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc).isoformat()
+    body = json.dumps(payload).encode()
+    signature = 'sha256=' + hmac.new(secret.encode(), messageID.encode() + timestamp.encode() + body, hashlib.sha256).hexdigest()
+    headers = {
+        'Twitch-Eventsub-Message-Id': messageID,
+        'Twitch-Eventsub-Message-Timestamp': timestamp,
+        'Twitch-Eventsub-Message-Signature': signature,
+        'Twitch-Eventsub-Message-Type': messageType
+    }
+    return headers, body
+
+subscription = {'id': 'f1c2a387-161a-49f9-a165-0f21d7a4e1c4', 'type': 'stream.online', 'version': '1', 'status': 'enabled', 'condition': {'broadcaster_user_id': '1337'}}
+onlineNotification = {'subscription': subscription, 'event': {'id': '9001', 'broadcaster_user_id': '1337', 'broadcaster_user_login': 'cool_user', 'type': 'live'}}
+
+async def handle(headers: dict, body: bytes) -> tuple[int, str]:
+    result = await sketchTwitch.handleEventSubMessage(headers, body)
+    # let any notification task it started run
+    await asyncio.sleep(0)
+    return result
+
+async def post(headers: dict, body: bytes) -> tuple[int, str]:
+    app = aiohttp.web.Application()
+    app.router.add_post('/twitch/eventsub', sketchServer.twitchEventSub)
+    async with aiohttp.test_utils.TestClient(aiohttp.test_utils.TestServer(app)) as client:
+        response = await client.post('/twitch/eventsub', headers=headers, data=body)
+        return response.status, await response.text()
+
+def test_verification_returns_challenge():
+    headers, body = fakeEventSubMessage('webhook_callback_verification', {'subscription': subscription, 'challenge': 'pogchamp-kappa-360noscope'})
+    assert asyncio.run(handle(headers, body)) == (200, 'pogchamp-kappa-360noscope')
+    headers, body = fakeEventSubMessage('webhook_callback_verification', {'subscription': subscription, 'challenge': 'over-http'})
+    assert asyncio.run(post(headers, body)) == (200, 'over-http')
+
+def test_notification_starts_handler(eventSub):
+    headers, body = fakeEventSubMessage('notification', onlineNotification)
+    assert asyncio.run(handle(headers, body)) == (204, '')
+    assert eventSub == [('stream.online', '1337')]
+
+    offline = {'subscription': dict(subscription, type='stream.offline'), 'event': {'broadcaster_user_id': '42'}}
+    headers, body = fakeEventSubMessage('notification', offline)
+    assert asyncio.run(post(headers, body))[0] == 204
+    assert eventSub == [('stream.online', '1337'), ('stream.offline', '42')]
+
+def test_duplicate_message_is_ignored(eventSub):
+    headers, body = fakeEventSubMessage('notification', onlineNotification)
+    assert asyncio.run(handle(headers, body)) == (204, '')
+    assert asyncio.run(handle(headers, body)) == (204, '')
+    assert asyncio.run(post(headers, body))[0] == 204
+    assert eventSub == [('stream.online', '1337')]
+
+def test_bad_signature_is_refused(eventSub):
+    headers, body = fakeEventSubMessage('notification', onlineNotification, secret='not the right secret')
+    assert asyncio.run(handle(headers, body))[0] == 403
+    assert asyncio.run(post(headers, body))[0] == 403
+    # a signature that isn't even ascii is still just a bad signature
+    headers['Twitch-Eventsub-Message-Signature'] = 'sha256=ünïcödé'
+    assert asyncio.run(handle(headers, body))[0] == 403
+    assert eventSub == []
+
+def test_old_message_is_refused(eventSub):
+    elevenMinutesAgo = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=11)).isoformat()
+    headers, body = fakeEventSubMessage('notification', onlineNotification, timestamp=elevenMinutesAgo)
+    assert asyncio.run(handle(headers, body))[0] == 403
+    assert asyncio.run(post(headers, body))[0] == 403
+    assert eventSub == []
+
+def test_unreadable_messages_are_refused(eventSub):
+    # a timestamp without an offset
+    headers, body = fakeEventSubMessage('notification', onlineNotification, timestamp=datetime.datetime.now().isoformat())
+    assert asyncio.run(handle(headers, body))[0] == 400
+    # a correctly signed body that isn't json
+    headers, _ = fakeEventSubMessage('notification', {})
+    body = b'not json'
+    headers['Twitch-Eventsub-Message-Signature'] = 'sha256=' + hmac.new(testSecret.encode(), headers['Twitch-Eventsub-Message-Id'].encode() + headers['Twitch-Eventsub-Message-Timestamp'].encode() + body, hashlib.sha256).hexdigest()
+    assert asyncio.run(post(headers, body))[0] == 400
+    assert eventSub == []
+
+def test_revocation(eventSub):
+    revoked = {'subscription': dict(subscription, status='authorization_revoked')}
+    headers, body = fakeEventSubMessage('revocation', revoked)
+    assert asyncio.run(handle(headers, body)) == (204, '')
+    headers, body = fakeEventSubMessage('revocation', revoked)
+    assert asyncio.run(post(headers, body))[0] == 204
+    assert eventSub == []
@@ -0,0 +1,30 @@
+import asyncio, datetime, logging
+import sketchYoutube
+
+def makeScheduler(renewed: list) -> sketchYoutube.LeaseScheduler:
+    scheduler = sketchYoutube.LeaseScheduler(batchSize=2, concurrency=2, jitterSeconds=0, retrySeconds=900)
+    # renewing just records the channel and pretends the hub verified the new lease straight away
+    async def renew(ytChannelID: str):
+        renewed.append(ytChannelID)
+        scheduler.schedule(ytChannelID, datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=5))
+    scheduler.renew = renew
+    return scheduler
+
+def test_batches_renew_soonest_first_and_log_stats(caplog):
+    renewed = []
+    scheduler = makeScheduler(renewed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    scheduler.schedule('UClater', now + datetime.timedelta(days=1))
+    scheduler.schedule('UCexpired', now - datetime.timedelta(hours=1))
+    scheduler.schedule('UCdue', now - datetime.timedelta(seconds=1))
+    scheduler.schedule('UCcancelled', now - datetime.timedelta(hours=2))
+    scheduler.cancel('UCcancelled')
+    assert scheduler.stats() == {'pending': 3, 'overdue': 2, 'renewing': 0}
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(scheduler.renewBatch(scheduler.takeBatch()))
+    assert renewed == ['UCexpired', 'UCdue']
+    assert scheduler.stats() == {'pending': 3, 'overdue': 0, 'renewing': 0}
+    assert 'Renewed a batch of 2 youtube leases, 3 leases scheduled, 0 expired without being renewed, 0 still renewing.' in [record.getMessage() for record in caplog.records]
+    # nothing else is due yet
+    assert scheduler.takeBatch() == []
@@ -0,0 +1,129 @@
+import datetime, time
+import lxml.etree
+import sketchDiscord
+
+# deliveries as the hub sends them, from https://developers.google.com/youtube/v3/guides/push_notifications
+uploadNotification = b'''<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+  <link rel="hub" href="https://pubsubhubbub.appspot.com"/>
+  <link rel="self" href="https://www.youtube.com/xml/feeds/videos.xml?channel_id=UCuAXFkgsw1L7xaCfnd5JJOw"/>
+  <title>YouTube video feed</title>
+  <updated>2015-04-01T19:05:24.552394234+00:00</updated>
+  <entry>
+    <id>yt:video:dQw4w9WgXcQ</id>
+    <yt:videoId>dQw4w9WgXcQ</yt:videoId>
+    <yt:channelId>UCuAXFkgsw1L7xaCfnd5JJOw</yt:channelId>
+    <title>Never Gonna Give You Up</title>
+    <link rel="alternate" href="http://www.youtube.com/watch?v=dQw4w9WgXcQ"/>
+    <author>
+     <name>Rick Astley</name>
+     <uri>http://www.youtube.com/channel/UCuAXFkgsw1L7xaCfnd5JJOw</uri>
+    </author>
+    <published>2015-03-06T21:40:57+00:00</published>
+    <updated>2015-03-09T19:05:24.552394234+00:00</updated>
+  </entry>
+</feed>'''
+
+deletedNotification = b'''<feed xmlns:at="http://purl.org/atompub/tombstones/1.0" xmlns="http://www.w3.org/2005/Atom">
+  <at:deleted-entry ref="yt:video:dQw4w9WgXcQ" when="2015-03-09T19:05:24.552394234+00:00">
+    <link href="https://www.youtube.com/watch?v=dQw4w9WgXcQ"/>
+    <at:by>
+     <name>Rick Astley</name>
+     <uri>https://www.youtube.com/channel/UCuAXFkgsw1L7xaCfnd5JJOw</uri>
+    </at:by>
+  </at:deleted-entry>
+</feed>'''
+
+# the same upload notification with a second entry, the hub can batch them
+secondEntry = b'''<entry>
+    <id>yt:video:yPYZpwSpKmA</id>
+    <yt:videoId>yPYZpwSpKmA</yt:videoId>
+    <yt:channelId>UCuAXFkgsw1L7xaCfnd5JJOw</yt:channelId>
+    <title>Together Forever</title>
+    <link rel="alternate" href="http://www.youtube.com/watch?v=yPYZpwSpKmA"/>
+    <author>
+     <name>Rick Astley</name>
+     <uri>http://www.youtube.com/channel/UCuAXFkgsw1L7xaCfnd5JJOw</uri>
+    </author>
+    <published>2015-03-07T21:40:57+00:00</published>
+    <updated>2015-03-07T21:40:57+00:00</updated>
+  </entry>
+</feed>'''
+multipleNotification = uploadNotification.replace(b'</feed>', secondEntry)
+
+def test_parse_upload():
+    videos = sketchDiscord.parseYoutubeNotification(uploadNotification)
+    assert len(videos) == 1
+    video = videos[0]
+    assert video['videoID'] == 'dQw4w9WgXcQ'
+    assert video['channelID'] == 'UCuAXFkgsw1L7xaCfnd5JJOw'
+    assert video['title'] == 'Never Gonna Give You Up'
+    assert video['url'] == 'http://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    assert video['channelName'] == 'Rick Astley'
+    assert video['published'] == datetime.datetime(2015, 3, 6, 21, 40, 57, tzinfo=datetime.timezone.utc)
+    assert video['updated'].replace(microsecond=0) == datetime.datetime(2015, 3, 9, 19, 5, 24, tzinfo=datetime.timezone.utc)
+    assert video['deleted'] is False
+
+def test_parse_deleted_entry():
+    videos = sketchDiscord.parseYoutubeNotification(deletedNotification)
+    assert len(videos) == 1
+    video = videos[0]
+    assert video['videoID'] == 'dQw4w9WgXcQ'
+    assert video['channelID'] == 'UCuAXFkgsw1L7xaCfnd5JJOw'
+    assert video['url'] == 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    assert video['channelName'] == 'Rick Astley'
+    assert video['title'] is None
+    assert video['published'] is None
+    assert video['updated'].replace(microsecond=0) == datetime.datetime(2015, 3, 9, 19, 5, 24, tzinfo=datetime.timezone.utc)
+    assert video['deleted'] is True
+
+def test_parse_multiple_entries():
+    videos = sketchDiscord.parseYoutubeNotification(multipleNotification)
+    assert [video['videoID'] for video in videos] == ['dQw4w9WgXcQ', 'yPYZpwSpKmA']
+    assert videos[1]['title'] == 'Together Forever'
+
+def test_parse_refuses_unreadable_notifications():
+    assert sketchDiscord.parseYoutubeNotification(b'<feed><entry>') == []
+    assert sketchDiscord.parseYoutubeNotification(b'<feed xmlns="http://www.w3.org/2005/Atom"/>') == []
+    tooBig = uploadNotification.replace(b'</feed>', b' ' * sketchDiscord.youtubeMaxNotificationBytes + b'</feed>')
+    assert sketchDiscord.parseYoutubeNotification(tooBig) == []
+
+def test_parse_refuses_entities():
+    # entities must never be expanded, or a small payload could blow up into a huge one
+    billionLaughs = b'''<?xml version="1.0"?>
+<!DOCTYPE feed [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">]>
+''' + uploadNotification.replace(b'Never Gonna Give You Up', b'&lol2;')
+    assert sketchDiscord.parseYoutubeNotification(billionLaughs) == []
+
+# the parser from before it was rewritten, kept here to compare against
+def parseYoutubeNotificationBefore(xmlBytes):
+    try:
+        tree = lxml.etree.fromstring(xmlBytes)
+        if tree.find('entry', tree.nsmap) is None:
+            return None
+        return {
+            'videoID': tree.find('entry/yt:videoId', tree.nsmap).text,
+            'channelID': tree.find('entry/yt:channelId', tree.nsmap).text,
+            'title': tree.find('entry/title', tree.nsmap).text,
+            'url': tree.find('entry/link', tree.nsmap).get('href'),
+            'channelName': tree.find('entry/author/name', tree.nsmap).text
+        }
+    except (lxml.etree.XMLSyntaxError, AttributeError):
+        return None
+
+def timeParser(parse, payload: bytes, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        parse(payload)
+    return (time.perf_counter() - start) / runs
+
+# run with -s to see the numbers, only the results are checked since timings depend on the machine
+def test_benchmark_against_previous_parser():
+    before = parseYoutubeNotificationBefore(uploadNotification)
+    after = sketchDiscord.parseYoutubeNotification(uploadNotification)[0]
+    assert {field: after[field] for field in before} == before
+
+    runs = 2000
+    for name, payload in (('upload', uploadNotification), ('deleted', deletedNotification), ('two entries', multipleNotification)):
+        beforeSeconds = timeParser(parseYoutubeNotificationBefore, payload, runs)
+        afterSeconds = timeParser(sketchDiscord.parseYoutubeNotification, payload, runs)
+        print(f'{name}: before {beforeSeconds * 1e6:.1f}us, after {afterSeconds * 1e6:.1f}us per notification')